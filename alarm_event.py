@@ -0,0 +1,128 @@
+"""
+This file contains the AlarmEvent record and extract_alarm_event, which turns an asyncua event into an AlarmEvent
+with a field extractor compiled once per event type and server.
+"""
+
+
+from operator import attrgetter
+from typing import Any, Callable, Dict, NamedTuple, Optional
+
+from asyncua import ua
+
+
+class AlarmEvent(NamedTuple):
+    """
+    The fields of an alarm event used by logging, dedup and notification.
+    LocalizedText fields hold their text. Fields the subscription does not select are None.
+    """
+    address: str
+    Message: Optional[str] = None
+    Time: Any = None
+    Severity: Optional[int] = None
+    SuppressedOrShelved: Any = None
+    AckedState: Optional[str] = None
+    ConditionClassId: Any = None
+    NodeId: Any = None
+    Quality: Any = None
+    Retain: Any = None
+    ActiveState: Optional[str] = None
+    EnabledState: Optional[str] = None
+    EventId: Optional[str] = None
+    Identifier: Optional[str] = None
+    ConditionId: Optional[str] = None
+
+
+# The event attributes copied into an AlarmEvent, in field order after address
+EVENT_FIELDS = (
+    "Message", "Time", "Severity", "SuppressedOrShelved",
+    "AckedState", "ConditionClassId", "NodeId", "Quality", "Retain",
+    "ActiveState", "EnabledState", "EventId"
+)
+
+_EVENT_ID_INDEX = EVENT_FIELDS.index("EventId")
+_NODE_ID_INDEX = EVENT_FIELDS.index("NodeId")
+_MESSAGE_INDEX = EVENT_FIELDS.index("Message")
+
+
+def _compile_extractor(event) -> Callable[[Any, str], AlarmEvent]:
+    """
+    Builds the extractor for events shaped like this one. The attributes the event has are
+    read with one attrgetter, and LocalizedText fields are found once instead of per event.
+    """
+    present = [index for index, field in enumerate(EVENT_FIELDS) if hasattr(event, field)]
+    if not present:
+        return lambda event, address: AlarmEvent(address)
+
+    getter = attrgetter(*(EVENT_FIELDS[index] for index in present))
+    text_fields = []
+    unknown_fields = []
+    for position, index in enumerate(present):
+        value = getattr(event, EVENT_FIELDS[index])
+        if isinstance(value, ua.LocalizedText):
+            text_fields.append(position)
+        elif value is None:
+            unknown_fields.append(position)
+
+    single = len(present) == 1
+
+    def extract(event, address: str) -> AlarmEvent:
+        values = getter(event)
+        values = [values] if single else list(values)
+
+        for position in text_fields:
+            value = values[position]
+            if value is not None:
+                values[position] = value.Text
+        for position in unknown_fields:
+            value = values[position]
+            if hasattr(value, "Text"):
+                values[position] = value.Text
+
+        fields = [None] * len(EVENT_FIELDS)
+        for position, index in enumerate(present):
+            fields[index] = values[position]
+
+        event_id = fields[_EVENT_ID_INDEX]
+        if isinstance(event_id, bytes):
+            fields[_EVENT_ID_INDEX] = event_id.hex()
+        elif event_id is not None:
+            fields[_EVENT_ID_INDEX] = str(event_id)
+
+        node_id = fields[_NODE_ID_INDEX]
+        if hasattr(node_id, "Identifier"):
+            identifier = str(node_id.Identifier)
+            condition_id = node_id.to_string()
+        else:
+            identifier = None
+            condition_id = str(fields[_MESSAGE_INDEX])
+
+        return AlarmEvent(address, *fields, identifier, condition_id)
+
+    return extract
+
+
+_extractors: Dict[Any, Callable[[Any, str], AlarmEvent]] = {}
+
+
+def extract_alarm_event(event, address: str) -> AlarmEvent:
+    """
+    Returns the AlarmEvent of an asyncua event, compiling the extractor on the first event of each
+    event type from each server. Servers select different attributes for the same event type, so
+    an extractor is only shared by the events of one server, and is compiled again if its events change shape.
+
+    Parameters
+    ----------
+    event - The event from the OPC UA subscription.
+    address - The address of the OPC UA server it came from.
+    """
+    key = (address, getattr(event, "EventType", None))
+    extractor = _extractors.get(key)
+    if extractor is not None:
+        try:
+            return extractor(event, address)
+        except AttributeError:
+            pass
+
+    extractor = _compile_extractor(event)
+    _extractors[key] = extractor
+    return extractor(event, address)
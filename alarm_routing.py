@@ -0,0 +1,174 @@
+"""
+This file contains the RoutingTable class, which compiles the phone book once into an index that finds
+the users to notify about an alarm with a few lookups.
+"""
+
+
+from bisect import bisect_right
+from datetime import datetime
+import re
+from typing import Any, Dict, List, NamedTuple, Optional, Pattern, Tuple
+
+
+class _Rule(NamedTuple):
+    user: int
+    phone_number: str
+    name: str
+    has_filter: bool
+    include: Optional[Pattern]
+    exclude: Optional[Pattern]
+
+
+# Sorted interval start points and the items covering each elementary segment
+_StabbingIndex = Tuple[List[int], List[tuple]]
+
+
+def parse_filter(filter_str):
+    # Split the filter string into include and exclude lists
+    parts = filter_str.split('.')
+    include_words = []
+    exclude_words = []
+
+    for part in parts:
+        if part.startswith('"') and part.endswith('"'):
+            include_words.append(part[1:-1].lower())  # Add phrase without quotes
+        elif part.startswith('-'):
+            exclude_words.append(part[1:].lower())  # Add word without minus
+        else:
+            include_words.append(part.lower())
+
+    return include_words, exclude_words
+
+
+def _compile_words(words: List[str]) -> Optional[Pattern]:
+    if not words:
+        return None
+    return re.compile("|".join(re.escape(word) for word in words))
+
+
+def _build_stabbing_index(intervals: List[Tuple[int, int, Any]]) -> _StabbingIndex:
+    """
+    Splits half-open [low, high) intervals into elementary segments, each holding the items
+    of every interval that covers it, in the order they were given.
+    """
+    boundaries = sorted({low for low, _, _ in intervals} | {high for _, high, _ in intervals})
+    segments = [tuple(item for low, high, item in intervals if low <= boundary < high)
+                for boundary in boundaries]
+    return boundaries, segments
+
+
+def _stab(index: _StabbingIndex, point: int) -> tuple:
+    boundaries, segments = index
+    position = bisect_right(boundaries, point) - 1
+    if position < 0:
+        return ()
+    return segments[position]
+
+
+def _time_of_day(value: str) -> int:
+    parsed = datetime.strptime(value, '%H:%M')
+    return (parsed.hour * 60 + parsed.minute) * 60 * 1_000_000
+
+
+class RoutingTable:
+    """
+    The phone book compiled into a routing index.
+
+    Per day the time settings are split into elementary time segments, and per time segment
+    the severity ranges into elementary severity segments, so finding the settings that apply
+    to an alarm is two binary searches. Each word filter is compiled once into an include and
+    an exclude regex. A user is notified through their first matching setting only.
+
+    Parameters
+    ----------
+    phone_book - The users from phone_book.json.
+    day_translation - Maps the names from strftime('%A') to the day names used in the phone book.
+    """
+
+    def __init__(self, phone_book: List[Dict[str, Any]], day_translation: Dict[str, str]):
+        self.day_translation = day_translation
+        self._days: Dict[str, _StabbingIndex] = {}
+
+        day_intervals: Dict[str, List[Tuple[int, int, Tuple[int, int, _Rule]]]] = {}
+        filters: Dict[str, Tuple[Optional[Pattern], Optional[Pattern]]] = {}
+
+        for user_index, user in enumerate(phone_book):
+            if user.get('Active') != 'Yes':
+                continue
+
+            for setting in user.get('timeSettings', []):
+                start_time = _time_of_day(setting.get('startTime', '00:00'))
+                end_time = _time_of_day(setting.get('endTime', '00:00'))
+                if start_time > end_time:
+                    continue
+
+                lowest_severity = int(setting.get('lowestSeverity', 0))
+                highest_severity = int(setting.get('highestSeverity', 100))
+
+                word_filter = setting.get('wordFilter', '')
+                if word_filter and word_filter not in filters:
+                    include_words, exclude_words = parse_filter(word_filter)
+                    filters[word_filter] = (_compile_words(include_words), _compile_words(exclude_words))
+                include, exclude = filters.get(word_filter, (None, None))
+
+                rule = _Rule(user_index, user.get('phone_number'), user.get('Name'),
+                             bool(word_filter), include, exclude)
+                severity_interval = (min(lowest_severity, highest_severity),
+                                     max(lowest_severity, highest_severity) + 1, rule)
+
+                # The end time is inclusive, so the interval ends one microsecond after it
+                for day in setting.get('days', []):
+                    day_intervals.setdefault(day, []).append((start_time, end_time + 1, severity_interval))
+
+        severity_indexes: Dict[tuple, _StabbingIndex] = {}
+        for day, intervals in day_intervals.items():
+            boundaries, segments = _build_stabbing_index(intervals)
+            for position, severity_intervals in enumerate(segments):
+                if severity_intervals not in severity_indexes:
+                    severity_indexes[severity_intervals] = _build_stabbing_index(list(severity_intervals))
+                segments[position] = severity_indexes[severity_intervals]
+            self._days[day] = (boundaries, segments)
+
+
+    def route(self, message: str, severity: int, now: Optional[datetime] = None) -> List[Tuple[str, str]]:
+        """
+        Returns the (phone_number, name) of every user to notify about an alarm.
+
+        Parameters
+        ----------
+        message - The alarm message.
+        severity - The alarm severity.
+        now - The time of the alarm, defaults to the current time.
+        """
+        if now is None:
+            now = datetime.now()
+
+        time_index = self._days.get(self.day_translation[now.strftime('%A')])
+        if time_index is None:
+            return []
+
+        time_of_day = ((now.hour * 60 + now.minute) * 60 + now.second) * 1_000_000 + now.microsecond
+        severity_index = _stab(time_index, time_of_day)
+        if not severity_index:
+            return []
+
+        recipients = []
+        notified = set()
+        message_lower = None
+
+        for rule in _stab(severity_index, severity):
+            if rule.user in notified:
+                continue
+
+            if rule.has_filter:
+                if message_lower is None:
+                    message_lower = message.lower()
+                if rule.include is None or not rule.include.search(message_lower):
+                    continue
+                if rule.exclude is not None and rule.exclude.search(message_lower):
+                    continue
+
+            notified.add(rule.user)
+            recipients.append((rule.phone_number, rule.name))
+
+        return recipients
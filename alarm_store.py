@@ -0,0 +1,235 @@
+"""
+This file contains the AlarmStore class, which is used to write alarms as JSON lines with a sidecar time index,
+and query_alarms to read them back by time range without scanning the whole file.
+"""
+
+
+import atexit
+from bisect import bisect_right
+from datetime import datetime
+import json
+import mmap
+import os
+from pathlib import Path
+import queue
+import struct
+import threading
+import time
+from typing import Any, Dict, List, Optional, Union
+
+try:
+    from create_logger import setup_logger
+    from alarm_event import AlarmEvent
+except ImportError:
+    print("Some modules was not found in. Please make sure it is in the same directory as this script.")
+
+##############################
+ALARM_STORE_QUEUE_SIZE = 10000
+INDEX_INTERVAL = 64
+##############################
+
+# Index entry: the logged time and the byte offset of a line in the alarm file
+INDEX_ENTRY = struct.Struct("<dQ")
+
+ALARM_FIELDS = ("Identifier", "Severity", "Time", "ActiveState", "AckedState", "Message")
+
+logger = setup_logger(__name__)
+
+
+def _default_path() -> Path:
+    return Path(__file__).parent.parent / "alarms" / "alarms.jsonl"
+
+
+def _timestamp(value: Union[datetime, float, None]) -> Optional[float]:
+    if isinstance(value, datetime):
+        return value.timestamp()
+    return value
+
+
+class AlarmStore:
+    """
+    Writes alarms as JSON lines with a sidecar index of (logged time, byte offset) entries.
+
+    Every INDEX_INTERVAL records one entry is added to the <file>.idx index, so a query can
+    seek straight to a time range. Writes are put on a bounded queue and done in batches by
+    a background thread, so append never touches the disk; when the queue is full the
+    record is dropped and counted.
+    """
+
+    def __init__(self, path: Union[str, Path, None] = None, queue_size: int = ALARM_STORE_QUEUE_SIZE):
+        self.path = Path(path) if path is not None else _default_path()
+        self.index_path = self.path.with_name(self.path.name + ".idx")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.dropped = 0
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._records_since_index = INDEX_INTERVAL
+        self._thread = threading.Thread(target=self._run, name="alarm_store", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+
+    def append(self, alarm: AlarmEvent):
+        """
+        Queue an alarm for writing. It is turned into JSON on the writer thread.
+
+        Parameters
+        ----------
+        alarm - The alarm, its address and the ALARM_FIELDS are stored.
+        """
+        try:
+            self._queue.put_nowait((time.time(), alarm))
+        except queue.Full:
+            self.dropped += 1
+
+
+    def _repair(self):
+        """
+        Ends a line left partly written by a killed process, so the next record starts on its own line,
+        and cuts a partly written index entry.
+        """
+        with open(self.path, "ab+") as data_file:
+            data_file.seek(0, os.SEEK_END)
+            if data_file.tell() > 0:
+                data_file.seek(-1, os.SEEK_END)
+                if data_file.read(1) != b"\n":
+                    logger.warning(f"{self.path} ends with a partly written line, starting a new line")
+                    data_file.write(b"\n")
+
+        with open(self.index_path, "ab+") as index_file:
+            size = index_file.seek(0, os.SEEK_END)
+            if size % INDEX_ENTRY.size:
+                index_file.truncate(size - size % INDEX_ENTRY.size)
+
+
+    def _run(self):
+        try:
+            self._repair()
+        except OSError as exception:
+            logger.error(f"Could not check {self.path} for a partly written line: {exception}")
+
+        with open(self.path, "ab") as data_file, open(self.index_path, "ab") as index_file:
+            running = True
+            while running:
+                batch = [self._queue.get()]
+                while True:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                for item in batch:
+                    if item is None:
+                        running = False
+                        continue
+                    try:
+                        self._write(data_file, index_file, *item)
+                    except (OSError, TypeError, ValueError) as exception:
+                        logger.error(f"Could not write alarm to {self.path}: {exception}")
+
+                data_file.flush()
+                index_file.flush()
+
+
+    def _write(self, data_file, index_file, logged: float, alarm: AlarmEvent):
+        record = {"logged": logged, "address": alarm.address}
+        for field in ALARM_FIELDS:
+            record[field] = getattr(alarm, field)
+        line = json.dumps(record, default=str, ensure_ascii=False).encode("utf-8") + b"\n"
+
+        if self._records_since_index >= INDEX_INTERVAL:
+            index_file.write(INDEX_ENTRY.pack(logged, data_file.tell()))
+            self._records_since_index = 0
+
+        data_file.write(line)
+        self._records_since_index += 1
+
+
+    def stop(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+
+
+    def query(self, start: Union[datetime, float, None] = None, end: Union[datetime, float, None] = None,
+              min_severity: int = 0, server: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Returns the alarms logged between start and end, see query_alarms.
+        """
+        return query_alarms(start, end, min_severity, server, self.path)
+
+
+def _read_index(index_path: Path) -> List[tuple]:
+    try:
+        data = index_path.read_bytes()
+    except FileNotFoundError:
+        return []
+    usable = len(data) - len(data) % INDEX_ENTRY.size
+    return list(INDEX_ENTRY.iter_unpack(data[:usable]))
+
+
+def query_alarms(start: Union[datetime, float, None] = None, end: Union[datetime, float, None] = None,
+                 min_severity: int = 0, server: Optional[str] = None,
+                 path: Union[str, Path, None] = None) -> List[Dict[str, Any]]:
+    """
+    Returns the alarms logged between start and end from an AlarmStore file.
+
+    The index is used to seek to the first line that can be in range, then the file is read
+    through mmap until the first record logged after end.
+
+    Parameters
+    ----------
+    start - Only alarms logged at or after this time, a datetime or epoch seconds.
+    end - Only alarms logged at or before this time, a datetime or epoch seconds.
+    min_severity - Only alarms with at least this severity.
+    server - Only alarms from this server address.
+    path - The alarm file, defaults to alarms/alarms.jsonl.
+
+    Returns
+    ----------
+    The matching alarm records as dictionaries, oldest first.
+    """
+    path = Path(path) if path is not None else _default_path()
+    start = _timestamp(start)
+    end = _timestamp(end)
+
+    offset = 0
+    if start is not None:
+        index = _read_index(path.with_name(path.name + ".idx"))
+        position = bisect_right([entry[0] for entry in index], start) - 1
+        if position >= 0:
+            offset = index[position][1]
+
+    alarms = []
+    try:
+        with open(path, "rb") as data_file:
+            if os.fstat(data_file.fileno()).st_size == 0:
+                return alarms
+
+            with mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                while offset < len(data):
+                    line_end = data.find(b"\n", offset)
+                    if line_end == -1:
+                        break  # Partly written last line
+                    line = data[offset:line_end]
+                    offset = line_end + 1
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        logger.warning(f"Skipped an unreadable line in {path}: {line[:100]!r}")
+                        continue
+
+                    if start is not None and record["logged"] < start:
+                        continue
+                    if end is not None and record["logged"] > end:
+                        break
+                    if server is not None and record["address"] != server:
+                        continue
+                    if (record.get("Severity") or 0) < min_severity:
+                        continue
+                    alarms.append(record)
+
+    except FileNotFoundError:
+        return alarms
+
+    return alarms
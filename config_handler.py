@@ -5,14 +5,193 @@ version: 1.0.0 Inital commit by Roberts balulis
 __version__ = "1.0.0"
 
 
+import copy
 import json
+import os
 from pathlib import Path
-from typing import Any, Dict
+import threading
+from types import MappingProxyType
+from typing import Any, Callable, Dict, List, Mapping, NamedTuple, Optional, Set, Tuple
+
+try:
+    from create_logger import setup_logger
+except ImportError:
+    print("The create_logger module was not found. Please make sure it is in the same directory as this script.")
+
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:
+    INotify = None
+
+##############################
+CONFIG_DEBOUNCE = 0.5
+CONFIG_POLL_INTERVAL = 2.0
+##############################
+
+logger = setup_logger(__name__)
+
+
+class _CachedConfig(NamedTuple):
+    stat: Tuple[int, int]
+    data: Dict[str, Any]
+    frozen: Mapping[str, Any]
+
+
+# Parsed configs shared by every ConfigHandler, keyed by file path
+_config_cache: Dict[Path, _CachedConfig] = {}
+_config_cache_lock = threading.Lock()
+
+
+def _freeze(value: Any) -> Any:
+    """
+    Returns a read-only view of parsed JSON, dicts become MappingProxyType and lists become tuples.
+    """
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+class ConfigWatcher:
+    """
+    Watches a configs directory and calls the subscribed callbacks with the new frozen config
+    when a config file has changed.
+
+    The directory is watched with inotify when the inotify_simple package is installed, else every
+    file with subscribers is polled with stat(). Changes are debounced, so an editor that writes a
+    file in several steps causes one reload, and a file that can not be parsed keeps its old config.
+    Callbacks run on the watcher thread, so they should only swap in the new state.
+    """
+
+    def __init__(self, handler: "ConfigHandler", debounce: float = CONFIG_DEBOUNCE,
+                 poll_interval: float = CONFIG_POLL_INTERVAL):
+        self.handler = handler
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self._callbacks: Dict[str, List[Callable[[Mapping[str, Any]], Any]]] = {}
+        self._delivered: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+
+    def subscribe(self, config_name: str, callback: Callable[[Mapping[str, Any]], Any]):
+        with self._lock:
+            if config_name not in self._delivered:
+                try:
+                    self._delivered[config_name] = self.handler.get_config_data(config_name, frozen=True)
+                except (OSError, ValueError):
+                    self._delivered[config_name] = None
+            self._callbacks.setdefault(config_name, []).append(callback)
+
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="config_watcher", daemon=True)
+                self._thread.start()
+
+
+    def unsubscribe(self, config_name: str, callback: Callable[[Mapping[str, Any]], Any]):
+        with self._lock:
+            callbacks = self._callbacks.get(config_name, [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+
+    def _run(self):
+        if INotify is not None:
+            try:
+                self._run_inotify()
+                return
+            except OSError as exception:
+                logger.warning(f"Could not watch {self.handler.config_path} with inotify, polling instead: {exception}")
+        self._run_polling()
+
+
+    def _run_inotify(self):
+        inotify = INotify()
+        try:
+            inotify.add_watch(str(self.handler.config_path), inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO
+                              | inotify_flags.CREATE | inotify_flags.DELETE)
+            while not self._stop.is_set():
+                changed = {event.name for event in inotify.read(timeout=1000)}
+                if not changed:
+                    continue
+
+                # Wait until the directory has been quiet for the debounce time
+                while True:
+                    events = inotify.read(timeout=int(self.debounce * 1000))
+                    if not events:
+                        break
+                    changed.update(event.name for event in events)
+
+                self._notify(changed)
+        finally:
+            inotify.close()
+
+
+    def _run_polling(self):
+        last_stats: Dict[str, Any] = {}
+        while not self._stop.wait(self.poll_interval):
+            stable = set()
+            for config_name in list(self._callbacks):
+                try:
+                    stat = os.stat(self.handler.config_path / config_name)
+                    file_stat = (stat.st_mtime_ns, stat.st_size)
+                except OSError:
+                    file_stat = None
+
+                # Only reload a file that has not changed since the previous poll
+                if file_stat is not None and file_stat == last_stats.get(config_name):
+                    stable.add(config_name)
+                last_stats[config_name] = file_stat
+
+            self._notify(stable)
+
+
+    def _notify(self, config_names: Set[str]):
+        for config_name in config_names:
+            with self._lock:
+                callbacks = list(self._callbacks.get(config_name, ()))
+            if not callbacks:
+                continue
+
+            try:
+                config = self.handler.get_config_data(config_name, frozen=True)
+            except (OSError, ValueError) as exception:
+                logger.error(f"Could not reload config {config_name}, keeping the old one: {exception}")
+                continue
+
+            if config is self._delivered.get(config_name):
+                continue
+            self._delivered[config_name] = config
+
+            logger.info(f"Config {config_name} has changed")
+            for callback in callbacks:
+                try:
+                    callback(config)
+                except Exception as exception:
+                    logger.error(f"Error in config callback for {config_name}: {exception}")
+
+
+# One watcher per configs directory
+_watchers: Dict[Path, ConfigWatcher] = {}
+_watchers_lock = threading.Lock()
 
 
 class ConfigHandler:
     """
     This class is used to handle configs files and return the data in them.
+
+    Parsed configs are kept in memory and only parsed again when a stat() of the file shows
+    a new modification time or size. With subscribe a callback gets the new config every time
+    the file changes, see ConfigWatcher.
     """
     def __init__(self) -> None:
 
@@ -23,13 +202,15 @@ class ConfigHandler:
             self.config_path.mkdir(parents=True, exist_ok=True)
 
 
-    def get_config_data(self, config_name: str) -> Dict[str, Any]:
+    def get_config_data(self, config_name: str, frozen: bool = False) -> Dict[str, Any]:
         """
         Returns the data in a config file as a dictionary.
 
         Parameters
         ----------
         config_name: The name of the config file to get the data from.
+        frozen: Return the shared read-only view instead of a copy the caller may change.
+                The same view is returned until the file changes, so it is cheap to call per event.
 
         Returns
         ----------
@@ -37,17 +218,58 @@ class ConfigHandler:
         """
 
         config_path = self.config_path / config_name
+        try:
+            stat = os.stat(config_path)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Config file {config_path} not found.")
+        file_stat = (stat.st_mtime_ns, stat.st_size)
+
+        cached = _config_cache.get(config_path)
+        if cached is None or cached.stat != file_stat:
+            with _config_cache_lock:
+                cached = _config_cache.get(config_path)
+                if cached is None or cached.stat != file_stat:
+                    cached = self._load(config_path, file_stat)
+                    _config_cache[config_path] = cached
+
+        if frozen:
+            return cached.frozen
+        return copy.deepcopy(cached.data)
+
+
+    def _load(self, config_path: Path, file_stat: Tuple[int, int]) -> _CachedConfig:
         try:
             with open(config_path, "r", encoding="UTF-8") as config_file:
                 config_data = json.load(config_file)
         except FileNotFoundError:
-            raise (f"Config file {config_path} not found.")
-        except json.decoder.JSONDecodeError:
-            raise (f"Config file {config_path} is not valid JSON.")
-        except Exception as exception:
-            raise exception
+            raise FileNotFoundError(f"Config file {config_path} not found.")
+        except json.decoder.JSONDecodeError as exception:
+            raise ValueError(f"Config file {config_path} is not valid JSON: {exception}")
+
+        return _CachedConfig(file_stat, config_data, _freeze(config_data))
+
+
+    def subscribe(self, config_name: str, callback: Callable[[Mapping[str, Any]], Any]):
+        """
+        Calls callback with the new frozen config every time the config file changes.
+
+        Parameters
+        ----------
+        config_name: The name of the config file to watch.
+        callback: Called on the watcher thread with the read-only view of the new config.
+        """
+        with _watchers_lock:
+            watcher = _watchers.get(self.config_path)
+            if watcher is None:
+                watcher = ConfigWatcher(self)
+                _watchers[self.config_path] = watcher
+        watcher.subscribe(config_name, callback)
+
 
-        return config_data
+    def unsubscribe(self, config_name: str, callback: Callable[[Mapping[str, Any]], Any]):
+        watcher = _watchers.get(self.config_path)
+        if watcher is not None:
+            watcher.unsubscribe(config_name, callback)
 
     @property
     def phone_book(self) -> dict:
@@ -5,11 +5,213 @@ version: 1.0.0 Inital commit by Roberts balulis
 __version__ = "1.0.0"
 
 
+import atexit
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+import gzip
 import logging
+import logging.handlers
 import os
+import queue
+import shutil
 import sys
+import threading
 
-def setup_logger(logger_name):
+##############################
+LOG_QUEUE_SIZE = 10000
+LOG_BATCH_SIZE = 500
+##############################
+
+# Errors of the log machinery itself, not set up with setup_logger so they can never end up in the file
+# that failed. Without handlers Python prints them to stderr
+logger = logging.getLogger(__name__)
+
+
+class _RotatingFileHandler(logging.handlers.BaseRotatingHandler):
+    """
+    FileHandler that rotates the log file when it reaches max_bytes or when the day changes.
+
+    Rotated files are named <log file>.<timestamp>, gzipped in a background thread if compress
+    is True, and only the newest backup_count rotated files are kept (all if 0). With batch set
+    the handler leaves flushing to the log writer thread, so a batch of records is flushed once.
+    """
+
+    def __init__(self, filename, max_bytes=0, rotate_daily=False, backup_count=0, compress=False, batch=False):
+        super().__init__(filename, "a")
+        self.max_bytes = max_bytes
+        self.rotate_daily = rotate_daily
+        self.backup_count = backup_count
+        self.compress = compress
+        self.batch = batch
+        self._day = date.today()
+
+
+    def shouldRollover(self, record):
+        if self.rotate_daily and date.today() != self._day:
+            return True
+        if self.max_bytes > 0:
+            if self.stream is None:
+                self.stream = self._open()
+            return self.stream.tell() >= self.max_bytes
+        return False
+
+
+    def doRollover(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+
+        rotated_base = f"{self.baseFilename}.{datetime.now():%Y-%m-%d_%H-%M-%S}"
+        rotated_file = rotated_base
+        counter = 1
+        while os.path.exists(rotated_file) or os.path.exists(f"{rotated_file}.gz"):
+            rotated_file = f"{rotated_base}.{counter}"
+            counter += 1
+
+        if os.path.exists(self.baseFilename):
+            os.rename(self.baseFilename, rotated_file)
+            _get_archiver().submit(_archive, self.baseFilename, rotated_file, self.compress, self.backup_count)
+
+        self._day = date.today()
+        self.stream = self._open()
+
+
+    def emit(self, record):
+        try:
+            if self.shouldRollover(record):
+                self.doRollover()
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(self.format(record) + self.terminator)
+            if not self.batch:
+                self.flush()
+        except Exception:
+            self.handleError(record)
+
+
+_archiver = None
+_archiver_lock = threading.Lock()
+
+
+def _get_archiver() -> ThreadPoolExecutor:
+    global _archiver
+    with _archiver_lock:
+        if _archiver is None:
+            _archiver = ThreadPoolExecutor(max_workers=1, thread_name_prefix="log_archiver")
+    return _archiver
+
+
+def _archive(log_file, rotated_file, compress, backup_count):
+    """
+    Gzips a rotated log file and removes the oldest rotated files beyond backup_count.
+    Runs on the archiver thread, away from the code doing the logging.
+
+    With compress only the finished .gz files are pruned, the plain rotated files are
+    still waiting for their turn on the archiver thread.
+    """
+    try:
+        if compress:
+            with open(rotated_file, "rb") as source, gzip.open(f"{rotated_file}.gz", "wb") as target:
+                shutil.copyfileobj(source, target)
+            os.remove(rotated_file)
+
+        if backup_count > 0:
+            log_dir, log_name = os.path.split(log_file)
+            rotated_files = [os.path.join(log_dir, file_name) for file_name in os.listdir(log_dir)
+                             if file_name.startswith(f"{log_name}.")
+                             and (not compress or file_name.endswith(".gz"))]
+            rotated_files.sort(key=os.path.getmtime)
+            for old_file in rotated_files[:-backup_count]:
+                os.remove(old_file)
+
+    except OSError as exception:
+        logger.error(f"Could not archive the rotated log file {rotated_file}: {exception}")
+
+
+class _LogWriter:
+    """
+    The single background thread that writes the records of every async logger to disk.
+    """
+
+    def __init__(self, queue_size: int):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, name="log_writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+
+    def _run(self):
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            while len(batch) < LOG_BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            handlers = set()
+            for item in batch:
+                if item is None:
+                    running = False
+                    continue
+                handler, record = item
+                handler.handle(record)
+                handlers.add(handler)
+
+            for handler in handlers:
+                handler.flush()
+
+
+    def stop(self):
+        if self._thread.is_alive():
+            self.queue.put(None)
+            self._thread.join(timeout=5)
+
+
+class _AsyncHandler(logging.handlers.QueueHandler):
+    """
+    Puts records on the log writer queue for the target handler. When the queue is full
+    the record is dropped and counted, or the caller blocks if block is True.
+    """
+
+    def __init__(self, writer: _LogWriter, target: logging.Handler, block: bool):
+        super().__init__(writer.queue)
+        self.target = target
+        self.block = block
+        self.dropped = 0
+
+
+    def enqueue(self, record):
+        if self.block:
+            self.queue.put((self.target, record))
+            return
+        try:
+            self.queue.put_nowait((self.target, record))
+        except queue.Full:
+            self.dropped += 1
+
+
+_log_writer = None
+_log_writer_lock = threading.Lock()
+
+# One handler per log file path and the names of the loggers already set up, shared by the whole process
+_FORMATTER = logging.Formatter('%(asctime)s|%(levelname)s|%(name)s|%(message)s', datefmt='%Y:%m:%d %H:%M:%S')
+_handlers = {}
+_configured_loggers = set()
+_setup_lock = threading.Lock()
+
+
+def _get_log_writer(queue_size: int) -> _LogWriter:
+    global _log_writer
+    with _log_writer_lock:
+        if _log_writer is None:
+            _log_writer = _LogWriter(queue_size)
+    return _log_writer
+
+
+def setup_logger(logger_name, async_mode=False, queue_size=LOG_QUEUE_SIZE, block=False,
+                 max_bytes=0, rotate_daily=False, backup_count=0, compress=False):
 
     """
     Creates and configures a logging instance for the specified module.
@@ -21,10 +223,23 @@ def setup_logger(logger_name):
     This will create a logger that writes messages to the 'module_name.log' file in the 'logs'
     directory. If the logger_name is 'alarms', it will write to the 'alarms' directory instead.
 
+    Calling it again with the same logger_name returns the already configured logger, and only
+    one handler is ever opened per log file, so repeated calls do not duplicate lines or open
+    more file handles. The options of the first call win.
+
     Parameters
     ----------
     logger_name - The name of the logger. This will be the name of the module where the
     logger is used.
+    async_mode - If True, records are put on a bounded queue and written to disk in batches
+    by a single background thread, so the caller (e.g. the asyncio event loop) never touches
+    the disk.
+    queue_size - The bound of the shared log queue. Only used by the first async logger.
+    block - If True, logging blocks when the queue is full, else the record is dropped.
+    max_bytes - Rotate the log file when it reaches this size. 0 disables size rotation.
+    rotate_daily - Rotate the log file when the day changes.
+    backup_count - The number of rotated files to keep. 0 keeps them all.
+    compress - Gzip rotated files in a background thread.
 
     Usage
     ----------
@@ -32,7 +247,33 @@ def setup_logger(logger_name):
     """
 
     logger = logging.getLogger(logger_name)
-    logger.setLevel(logging.DEBUG)
+    if logger_name in _configured_loggers:
+        return logger
+
+    with _setup_lock:
+        if logger_name in _configured_loggers:
+            return logger
+
+        logger.setLevel(logging.DEBUG)
+        log_file = _log_file_path(logger_name)
+
+        handler = _handlers.get(log_file)
+        if handler is None:
+            handler = _create_handler(log_file, async_mode, queue_size, block,
+                                      max_bytes, rotate_daily, backup_count, compress)
+            _handlers[log_file] = handler
+
+        if handler not in logger.handlers:
+            logger.addHandler(handler)
+        _configured_loggers.add(logger_name)
+
+    return logger
+
+
+def _log_file_path(logger_name):
+    """
+    Returns the log file of the logger, creating the logs or alarms directory if needed.
+    """
 
     if getattr(sys, 'frozen', False): # If the program is running in a PyInstaller bundle
         app_path = sys._MEIPASS
@@ -58,13 +299,25 @@ def setup_logger(logger_name):
         except PermissionError:
             raise PermissionError("There was a problem creating the alarms directory. Please check your permissions and try again.")
 
-    log_file = os.path.join(log_dir, f"{logger_name}.log")
-    formatter = logging.Formatter('%(asctime)s|%(levelname)s|%(name)s|%(message)s', datefmt='%Y:%m:%d %H:%M:%S')
+    return os.path.join(log_dir, f"{logger_name}.log")
+
 
-    file_handler = logging.FileHandler(log_file)
-    file_handler.setFormatter(formatter)
+def _create_handler(log_file, async_mode, queue_size, block, max_bytes, rotate_daily, backup_count, compress):
+    """
+    Creates the handler that writes to log_file, see setup_logger for the options.
+    """
+
+    if async_mode or max_bytes > 0 or rotate_daily:
+        file_handler = _RotatingFileHandler(log_file, max_bytes, rotate_daily, backup_count, compress,
+                                            batch=async_mode)
+    else:
+        file_handler = logging.FileHandler(log_file)
+    file_handler.setFormatter(_FORMATTER)
     file_handler.setLevel(logging.DEBUG)
 
-    logger.addHandler(file_handler)
+    if async_mode:
+        queue_handler = _AsyncHandler(_get_log_writer(queue_size), file_handler, block)
+        queue_handler.setLevel(logging.DEBUG)
+        return queue_handler
 
-    return logger
\ No newline at end of file
+    return file_handler
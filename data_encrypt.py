@@ -1,23 +1,248 @@
 """
 This file contains class to encrypt and decrypt json files that can contain sensetive data by encrypting it with Fernet and keeping
-the key in the operating system's environment variables.
+the key in the operating system's environment variables. Large files can be encrypted as a stream of AES-GCM frames,
+and files can be re-encrypted with a new key with rotate_file and rotate_directory.
 version: 1.0.0 Inital commit by Roberts balulis
 """
 __version__ = "1.0.0"
 
 
+import base64
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import copy
+import hashlib
+import io
 from pathlib import Path
 import json
 import os
-from cryptography.fernet import Fernet, InvalidToken
+import struct
+import threading
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 
 try:
     from create_logger import setup_logger
 except ImportError:
     print("The create_logger module was not found. Please make sure it is in the same directory as this script.")
 
+##############################
+STREAM_FRAME_SIZE = 1024 * 1024
+ROTATE_WORKERS = 8
+##############################
+
+# Files are rotated into a temporary file next to them that replaces the original when complete
+ROTATE_SUFFIX = ".rotating"
+ROTATE_ROTATED = "rotated"
+ROTATE_CURRENT = "current"
+ROTATE_PLAIN = "plain"
+ROTATE_FAILED = "failed"
+
+# Stream format: a header of magic, version, frame size and a random salt, then frames of
+# nonce + AES-GCM ciphertext + tag. Every frame but the last holds frame size bytes of plain data.
+STREAM_MAGIC = b"RHLSTRM\x01"
+STREAM_VERSION = 1
+STREAM_HEADER = struct.Struct("<8sBI16s")
+# Authenticated with every frame, so frames can not be reordered and the stream can not be truncated
+FRAME_AAD = struct.Struct("<QB")
+NONCE_SIZE = 12
+TAG_SIZE = 16
+FRAME_OVERHEAD = NONCE_SIZE + TAG_SIZE
+
+# Every Fernet token starts with the version byte 0x80 followed by a timestamp
+FERNET_PREFIX = b"gAAAAA"
+
 logger = setup_logger(__name__)
 
+# MultiFernet instances by keys, and decrypted configs by path with the (mtime, size, key fingerprint)
+# they were decrypted from. Kept in memory only, see DataEncryptor.clear_cache.
+_fernets: Dict[Tuple[bytes, ...], MultiFernet] = {}
+_credential_cache: Dict[Path, Tuple[Tuple[int, int, str], Dict[str, Any]]] = {}
+_cache_lock = threading.Lock()
+
+Keys = Union[str, bytes, Sequence[Union[str, bytes]]]
+
+
+def _as_keys(keys: Keys) -> Tuple[bytes, ...]:
+    """
+    Returns a key or a list of keys, newest first, as a tuple of bytes.
+    """
+    if isinstance(keys, (str, bytes)):
+        keys = [keys]
+    keys = tuple(key.encode() if isinstance(key, str) else key for key in keys)
+    if not keys:
+        raise ValueError("No encryption key given.")
+    return keys
+
+
+def _keys_from_env(env_key_name: str) -> Tuple[bytes, ...]:
+    """
+    Returns the keys in an environment variable. During a key rotation it holds
+    a comma separated list of keys, newest first.
+    """
+    value = os.environ.get(env_key_name)
+
+    if value is None:
+        logger.error(f"{env_key_name} is not set in the environment")
+        raise ValueError(f"{env_key_name} is not set in the environment")
+
+    return _as_keys([key.strip() for key in value.split(",") if key.strip()])
+
+
+def _get_fernet(keys: Keys) -> MultiFernet:
+    """
+    Returns the MultiFernet that encrypts with the first key and decrypts with any of the keys.
+    """
+    keys = _as_keys(keys)
+    fernet = _fernets.get(keys)
+    if fernet is None:
+        fernet = MultiFernet([Fernet(key) for key in keys])
+        _fernets[keys] = fernet
+    return fernet
+
+
+def _key_fingerprint(keys: Keys) -> str:
+    return hashlib.sha256(b",".join(_as_keys(keys))).hexdigest()
+
+
+def _read_file(file_path) -> bytes:
+    try:
+        with open(file_path, 'rb') as file:
+            return file.read()
+    except FileNotFoundError:
+        logger.error(f"File {file_path} not found")
+        raise FileNotFoundError(f"File {file_path} not found")
+
+    except PermissionError:
+        logger.error(f"Permission denied for file {file_path}")
+        raise PermissionError(f"Permission denied for file {file_path}")
+
+
+def _is_encrypted_data(data: bytes) -> bool:
+    return data.startswith(STREAM_MAGIC) or data.startswith(FERNET_PREFIX)
+
+
+def _read_exact(source: BinaryIO, size: int) -> bytes:
+    data = source.read(size)
+    while data and len(data) < size:
+        more = source.read(size - len(data))
+        if not more:
+            break
+        data += more
+    return data
+
+
+def _stream_cipher(key: bytes, salt: bytes) -> AESGCM:
+    """
+    Derives the AES-256-GCM key of one stream from the Fernet key and the stream's salt.
+    """
+    try:
+        key_material = base64.urlsafe_b64decode(key)
+    except ValueError:
+        raise ValueError("The encryption key is not a valid Fernet key.")
+    if len(key_material) != 32:
+        raise ValueError("The encryption key is not a valid Fernet key.")
+
+    hkdf = HKDF(algorithm=hashes.SHA256(), length=32, salt=salt, info=b"data_encrypt stream")
+    return AESGCM(hkdf.derive(key_material))
+
+
+def _read_stream_header(source: BinaryIO) -> Tuple[bytes, int, bytes]:
+    header = _read_exact(source, STREAM_HEADER.size)
+    if len(header) < STREAM_HEADER.size:
+        raise ValueError("Not an encrypted stream, the header is missing.")
+
+    magic, version, frame_size, salt = STREAM_HEADER.unpack(header)
+    if magic != STREAM_MAGIC:
+        raise ValueError("Not an encrypted stream, wrong magic header.")
+    if version != STREAM_VERSION:
+        raise ValueError(f"Unsupported encrypted stream version {version}.")
+    return header, frame_size, salt
+
+
+def _encrypt_frame(cipher: AESGCM, header: bytes, index: int, data: bytes, final: bool) -> bytes:
+    nonce = os.urandom(NONCE_SIZE)
+    return nonce + cipher.encrypt(nonce, data, header + FRAME_AAD.pack(index, final))
+
+
+def _decrypt_frame(ciphers: Sequence[AESGCM], header: bytes, index: int, frame: bytes,
+                   final: bool) -> Tuple[AESGCM, bytes]:
+    """
+    Decrypts a frame with the first cipher that can, and returns that cipher and the plain data.
+    """
+    if len(frame) < FRAME_OVERHEAD:
+        logger.error("Encrypted stream is truncated.")
+        raise ValueError("Encrypted stream is truncated.")
+
+    aad = header + FRAME_AAD.pack(index, final)
+    for cipher in ciphers:
+        try:
+            return cipher, cipher.decrypt(frame[:NONCE_SIZE], frame[NONCE_SIZE:], aad)
+        except InvalidTag:
+            continue
+
+    logger.error("Invalid encryption token or corrupted data.")
+    raise ValueError("Invalid encryption token or corrupted data.")
+
+
+def _rotate_stream(source: BinaryIO, destination: BinaryIO, keys: Tuple[bytes, ...]) -> bool:
+    """
+    Re-encrypts a stream with the newest key and a new salt, frame by frame.
+    Returns False without writing anything when the stream already uses the newest key.
+    """
+    header, frame_size, salt = _read_stream_header(source)
+    ciphers = [_stream_cipher(key, salt) for key in keys]
+
+    new_salt = os.urandom(16)
+    new_header = STREAM_HEADER.pack(STREAM_MAGIC, STREAM_VERSION, frame_size, new_salt)
+    new_cipher = _stream_cipher(keys[0], new_salt)
+
+    for index, frame, final in _plain_frames(source, frame_size + FRAME_OVERHEAD):
+        cipher, data = _decrypt_frame(ciphers, header, index, frame, final)
+        if index == 0:
+            if cipher is ciphers[0]:
+                return False
+            ciphers = [cipher]
+            destination.write(new_header)
+        destination.write(_encrypt_frame(new_cipher, new_header, index, data, final))
+    return True
+
+
+def _plain_frames(source: BinaryIO, frame_size: int) -> Iterator[Tuple[int, bytes, bool]]:
+    """
+    Yields (index, data, final) for every frame of the source, reading one frame ahead to find the last one.
+    """
+    data = _read_exact(source, frame_size)
+    index = 0
+    while True:
+        next_data = _read_exact(source, frame_size) if len(data) == frame_size else b""
+        final = not next_data
+        yield index, data, final
+        if final:
+            return
+        data = next_data
+        index += 1
+
+
+def _decrypt_data(data: bytes, key: Keys) -> bytes:
+    """
+    Decrypts the contents of an encrypted file, a Fernet token or the stream format.
+    """
+    if data.startswith(STREAM_MAGIC):
+        decrypted = io.BytesIO()
+        DataEncryptor.decrypt_stream(io.BytesIO(data), decrypted, key)
+        return decrypted.getvalue()
+
+    try:
+        return _get_fernet(key).decrypt(data)
+    except InvalidToken:
+        logger.error("Invalid encryption token or corrupted data.")
+        raise ValueError("Invalid encryption token or corrupted data.")
+
 
 class DataEncryptor():
     """
@@ -26,6 +251,9 @@ class DataEncryptor():
     This class provides methods to handle encryption and decryption of
     sensitive data files using Fernet encryption. The encryption key is
     retrieved from the operating system's environment variables.
+
+    Decrypted configs are cached in memory until the file or the key changes,
+    so repeated calls to encrypt_credentials do not read or decrypt the file again.
     """
 
     def __init__(self):
@@ -45,6 +273,7 @@ class DataEncryptor():
         ----------
         config_filename - The name of the configuration file to be encrypted/decrypted.
         env_key_name - The name of the environment variable where the encryption key is stored.
+                       During a key rotation it can hold a comma separated list of keys, newest first.
 
         Returns
         -------
@@ -54,21 +283,45 @@ class DataEncryptor():
 
         config_path = self.output_path / "configs" / config_filename
 
-        key = os.environ.get(env_key_name)
+        key = _keys_from_env(env_key_name)
+        fingerprint = _key_fingerprint(key)
 
-        if key is None:
-            logger.error(f"{env_key_name} is not set in the environment")
-            raise ValueError(f"{env_key_name} is not set in the environment")
+        try:
+            stat = os.stat(config_path)
+        except FileNotFoundError:
+            logger.error(f"File {config_path} not found")
+            raise FileNotFoundError(f"File {config_path} not found")
+
+        cache_key = (stat.st_mtime_ns, stat.st_size, fingerprint)
+        cached = _credential_cache.get(config_path)
+        if cached is not None and cached[0] == cache_key:
+            return copy.deepcopy(cached[1])
+
+        data = _read_file(config_path)
+
+        if _is_encrypted_data(data):
+            config = json.loads(_decrypt_data(data, key))
+        else:
+            config = json.loads(data)
+            with open(config_path, 'wb') as file:
+                file.write(_get_fernet(key).encrypt(data))
+            stat = os.stat(config_path)
+            cache_key = (stat.st_mtime_ns, stat.st_size, fingerprint)
 
-        key = key.encode()
+        with _cache_lock:
+            _credential_cache[config_path] = (cache_key, config)
 
-        if not self.is_encrypted(config_path):
-            self.encrypt_file(config_path, key)
+        return copy.deepcopy(config)
 
-        decrypted_data = self.decrypt_file(config_path, key)
-        config = json.loads(decrypted_data)
 
-        return config
+    @staticmethod
+    def clear_cache():
+        """
+        Drops the decrypted configs and the MultiFernet instances held in memory.
+        """
+        with _cache_lock:
+            _credential_cache.clear()
+            _fernets.clear()
 
 
     @staticmethod
@@ -79,21 +332,11 @@ class DataEncryptor():
         Parameters
         ----------
         file_path: - The path to the file to be encrypted.
-        key: - The encryption key.
+        key: - The encryption key, or a list of keys where the first is used.
         """
 
-        try:
-            with open(file_path, 'rb') as file:
-                data = file.read()
-        except FileNotFoundError:
-            logger.error(f"File {file_path} not found")
-            raise FileNotFoundError(f"File {file_path} not found")
-
-        except PermissionError:
-            logger.error(f"Permission denied for file {file_path}")
-            raise PermissionError(f"Permission denied for file {file_path}")
-
-        fernet_key = Fernet(key)
+        data = _read_file(file_path)
+        fernet_key = _get_fernet(key)
 
         try:
             encrypted_data = fernet_key.encrypt(data)
@@ -106,41 +349,120 @@ class DataEncryptor():
 
 
     @staticmethod
-    def decrypt_file(file_path:str, key:str) -> bytes:
+    def encrypt_stream(source: BinaryIO, destination: BinaryIO, key: Keys,
+                       frame_size: int = STREAM_FRAME_SIZE, workers: int = 1) -> int:
         """
-        Decrypts a file using the given key and returns its contents.
+        Encrypts a binary stream into the chunked stream format, holding only a few frames in memory.
 
         Parameters
         ----------
-        file_path: str - The path to the file to be encrypted.
-        key: str - The encryption key.
+        source: - The binary file object to read the plain data from.
+        destination: - The binary file object to write the encrypted stream to.
+        key: - The encryption key, a Fernet key or a list of them where the first is used.
+        frame_size: - The number of plain bytes per frame.
+        workers: - With more than 1 the frames are encrypted on this many threads.
+
+        Returns
+        ----------
+        The number of frames written.
         """
+        salt = os.urandom(16)
+        header = STREAM_HEADER.pack(STREAM_MAGIC, STREAM_VERSION, frame_size, salt)
+        cipher = _stream_cipher(_as_keys(key)[0], salt)
+        destination.write(header)
+
+        frames = 0
+        if workers <= 1:
+            for index, data, final in _plain_frames(source, frame_size):
+                destination.write(_encrypt_frame(cipher, header, index, data, final))
+                frames += 1
+            return frames
+
+        # Frames are written in order, with at most two frames per worker in flight
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="data_encrypt") as executor:
+            pending = deque()
+            for index, data, final in _plain_frames(source, frame_size):
+                pending.append(executor.submit(_encrypt_frame, cipher, header, index, data, final))
+                if len(pending) >= 2 * workers:
+                    destination.write(pending.popleft().result())
+                    frames += 1
+            while pending:
+                destination.write(pending.popleft().result())
+                frames += 1
+        return frames
 
-        try:
-            with open(file_path, 'rb') as file:
-                encrypted_data = file.read()
-        except FileNotFoundError:
-            logger.error(f"File {file_path} not found")
-            raise FileNotFoundError(f"File {file_path} not found")
 
-        except PermissionError:
-            logger.error(f"Permission denied for file {file_path}")
-            raise PermissionError(f"Permission denied for file {file_path}")
+    @staticmethod
+    def decrypt_stream(source: BinaryIO, destination: BinaryIO, key: Keys) -> int:
+        """
+        Decrypts a stream written by encrypt_stream, one frame at a time.
+
+        Parameters
+        ----------
+        source: - The binary file object to read the encrypted stream from.
+        destination: - The binary file object to write the plain data to.
+        key: - The encryption key, a Fernet key or a list of them tried in order.
 
-        fernet_key = Fernet(key)
+        Returns
+        ----------
+        The number of frames read.
+        """
+        header, frame_size, salt = _read_stream_header(source)
+        ciphers = [_stream_cipher(stream_key, salt) for stream_key in _as_keys(key)]
 
-        try:
-            decrypted_data = fernet_key.decrypt(encrypted_data)
-        except InvalidToken:
-            logger.error("Invalid encryption token or corrupted data.")
-            raise ValueError("Invalid encryption token or corrupted data.")
+        frames = 0
+        for index, frame, final in _plain_frames(source, frame_size + FRAME_OVERHEAD):
+            cipher, data = _decrypt_frame(ciphers, header, index, frame, final)
+            ciphers = [cipher]
+            destination.write(data)
+            frames += 1
+        return frames
 
-        return decrypted_data
+
+    @staticmethod
+    def decrypt_frame(file_path: str, index: int, key: Keys) -> bytes:
+        """
+        Decrypts a single frame of an encrypted stream file without reading the frames before it.
+
+        Parameters
+        ----------
+        file_path: - The path to the encrypted stream file.
+        index: - The index of the frame, frame i holds the plain bytes from i * frame size.
+        key: - The encryption key, a Fernet key or a list of them tried in order.
+        """
+        with open(file_path, 'rb') as file:
+            header, frame_size, salt = _read_stream_header(file)
+            file_size = os.fstat(file.fileno()).st_size
+            offset = STREAM_HEADER.size + index * (frame_size + FRAME_OVERHEAD)
+            if index < 0 or offset >= file_size:
+                raise IndexError(f"Frame {index} is not in {file_path}")
+
+            file.seek(offset)
+            frame = _read_exact(file, frame_size + FRAME_OVERHEAD)
+            final = offset + len(frame) == file_size
+
+        ciphers = [_stream_cipher(stream_key, salt) for stream_key in _as_keys(key)]
+        return _decrypt_frame(ciphers, header, index, frame, final)[1]
+
+
+    @staticmethod
+    def decrypt_file(file_path:str, key:str) -> bytes:
+        """
+        Decrypts a file using the given key and returns its contents.
+
+        Parameters
+        ----------
+        file_path: str - The path to the file to be encrypted.
+        key: str - The encryption key, or a list of keys tried in order.
+        """
+
+        return _decrypt_data(_read_file(file_path), key)
 
 
     def is_encrypted(self, file_path:str) -> bool:
         """
-        Checks if a file is encrypted by trying to load it as a JSON file.
+        Checks if a file is encrypted from its first bytes, the magic header of the
+        stream format or the version prefix of a Fernet token.
 
         Parameters
         ----------
@@ -149,8 +471,7 @@ class DataEncryptor():
 
         try:
             with open(file_path, 'rb') as file:
-                data = file.read()
-
+                head = file.read(len(STREAM_MAGIC))
         except FileNotFoundError:
             logger.error(f"File {file_path} not found")
             raise FileNotFoundError(f"File {file_path} not found")
@@ -159,11 +480,7 @@ class DataEncryptor():
             logger.error(f"Permission denied for file {file_path}")
             raise PermissionError(f"Permission denied for file {file_path}")
 
-        try:
-            json.loads(data)
-            return False
-        except json.JSONDecodeError:
-            return True
+        return _is_encrypted_data(head)
 
 
     def decrypt_file_to_edit(self, config_filename: str, env_key_name: str):
@@ -180,13 +497,7 @@ class DataEncryptor():
 
         config_path = self.output_path / "configs" / config_filename
 
-        key = os.environ.get(env_key_name)
-
-        if key is None:
-            logger.error(f"{env_key_name} is not set in the environment")
-            raise ValueError(f"{env_key_name} is not set in the environment")
-
-        key = key.encode()
+        key = _keys_from_env(env_key_name)
 
         if self.is_encrypted(config_path):
             decrypted_data = self.decrypt_file(config_path, key)
@@ -195,3 +506,112 @@ class DataEncryptor():
         else:
             logger.info(f"File {config_filename} is already decrypted.")
 
+
+    @staticmethod
+    def rotate_file(file_path: str, keys: Keys) -> str:
+        """
+        Re-encrypts an encrypted file with the newest key.
+
+        The file is written to a temporary file next to it that atomically replaces it, so a crash
+        leaves either the old or the new file. A file that already uses the newest key is left alone,
+        so a rotation that was stopped can be run again.
+
+        Parameters
+        ----------
+        file_path: - The path to the file to rotate.
+        keys: - The keys, newest first. The file can be encrypted with any of them.
+
+        Returns
+        ----------
+        ROTATE_ROTATED, ROTATE_CURRENT when it already used the newest key, or ROTATE_PLAIN when it is not encrypted.
+        """
+        keys = _as_keys(keys)
+        file_path = Path(file_path)
+        temp_path = file_path.with_name(file_path.name + ROTATE_SUFFIX)
+
+        with open(file_path, 'rb') as source:
+            head = source.read(len(STREAM_MAGIC))
+        if not _is_encrypted_data(head):
+            return ROTATE_PLAIN
+
+        try:
+            with open(file_path, 'rb') as source, open(temp_path, 'wb') as destination:
+                if head.startswith(STREAM_MAGIC):
+                    rotated = _rotate_stream(source, destination, keys)
+                else:
+                    data = source.read()
+                    try:
+                        _get_fernet(keys[:1]).decrypt(data)
+                        rotated = False
+                    except InvalidToken:
+                        try:
+                            destination.write(_get_fernet(keys).rotate(data))
+                        except InvalidToken:
+                            logger.error(f"Invalid encryption token or corrupted data in {file_path}.")
+                            raise ValueError(f"Invalid encryption token or corrupted data in {file_path}.")
+                        rotated = True
+
+                destination.flush()
+                os.fsync(destination.fileno())
+
+            # Both files are closed here, Windows can not replace a file that is open
+            if not rotated:
+                os.remove(temp_path)
+                return ROTATE_CURRENT
+            os.replace(temp_path, file_path)
+
+        except BaseException:
+            if temp_path.exists():
+                os.remove(temp_path)
+            raise
+
+        return ROTATE_ROTATED
+
+
+    def rotate_directory(self, keys: Keys, directory: Optional[str] = None,
+                         workers: int = ROTATE_WORKERS) -> Dict[str, str]:
+        """
+        Re-encrypts every encrypted file under the configs directory with the newest key, see rotate_file.
+
+        The files are rotated in parallel on a thread pool. Temporary files left by a crashed
+        rotation are removed first, and files that already use the newest key are skipped, so
+        running it again finishes a rotation that was stopped.
+
+        Parameters
+        ----------
+        keys: - The keys, newest first.
+        directory: - The directory to rotate, defaults to configs.
+        workers: - The number of threads.
+
+        Returns
+        ----------
+        The result of every file, by path relative to the directory. A file that could not be rotated is ROTATE_FAILED.
+        """
+        keys = _as_keys(keys)
+        directory = Path(directory) if directory is not None else self.output_path / "configs"
+
+        files: List[Path] = []
+        for path in directory.rglob("*"):
+            if not path.is_file():
+                continue
+            if path.name.endswith(ROTATE_SUFFIX):
+                logger.warning(f"Removing {path} left by an unfinished rotation")
+                os.remove(path)
+                continue
+            files.append(path)
+
+        def rotate(path: Path) -> str:
+            try:
+                return self.rotate_file(path, keys)
+            except Exception as exception:
+                logger.error(f"Could not rotate {path}: {exception}")
+                return ROTATE_FAILED
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="data_encrypt_rotate") as executor:
+            results = {str(path.relative_to(directory)): result
+                       for path, result in zip(files, executor.map(rotate, files))}
+
+        counts = {result: list(results.values()).count(result)
+                  for result in (ROTATE_ROTATED, ROTATE_CURRENT, ROTATE_PLAIN, ROTATE_FAILED)}
+        logger.info(f"Rotated {directory}: {counts}")
+        return results
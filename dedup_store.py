@@ -0,0 +1,211 @@
+"""
+This file contains the DedupStore class, which is used to remember which alarms have already been handled,
+bounded in size and time, with optional persistence to a local SQLite file.
+"""
+
+
+import atexit
+from collections import OrderedDict
+import json
+from pathlib import Path
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Hashable, Iterable, Optional, Tuple, Union
+
+try:
+    from create_logger import setup_logger
+except ImportError:
+    print("The create_logger module was not found. Please make sure it is in the same directory as this script.")
+
+##############################
+DEDUP_TTL = 7 * 24 * 3600
+DEDUP_MAX_SIZE = 100000
+DEDUP_COMMIT_INTERVAL = 1.0
+##############################
+
+logger = setup_logger(__name__)
+
+
+class SqliteDedupBackend:
+    """
+    Persists the entries of a DedupStore to a SQLite file so they survive a restart.
+
+    add and remove only record the change in memory, so the caller, e.g. the asyncio event loop,
+    never waits for SQLite or the disk. A writer thread applies the changes and commits every
+    commit_interval seconds, and once more on close(), which also runs at exit. Keys must be
+    tuples of JSON serializable values.
+    """
+
+    def __init__(self, path: Union[str, Path], commit_interval: float = DEDUP_COMMIT_INTERVAL):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.commit_interval = commit_interval
+        self._connection = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS dedup (key TEXT PRIMARY KEY, expires REAL NOT NULL)")
+        self._connection.commit()
+        self._connection_lock = threading.Lock()
+
+        # The latest change per key, the expiry time to store or None to delete it
+        self._pending: Dict[Hashable, Optional[float]] = {}
+        self._pending_lock = threading.Lock()
+        self._closed = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="dedup_writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+
+    def load(self, now: float) -> Iterable[Tuple[Hashable, float]]:
+        with self._connection_lock:
+            self._connection.execute("DELETE FROM dedup WHERE expires <= ?", (now,))
+            rows = self._connection.execute("SELECT key, expires FROM dedup ORDER BY expires").fetchall()
+            self._connection.commit()
+        return [(tuple(json.loads(key)), expires) for key, expires in rows]
+
+
+    def add(self, key: Hashable, expires: float):
+        with self._pending_lock:
+            if not self._closed:
+                self._pending[key] = expires
+
+
+    def remove(self, key: Hashable):
+        with self._pending_lock:
+            if not self._closed:
+                self._pending[key] = None
+
+
+    def _run(self):
+        while not self._stop.wait(self.commit_interval):
+            self._flush()
+
+
+    def _flush(self):
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        inserts = [(json.dumps(list(key)), expires) for key, expires in pending.items() if expires is not None]
+        deletes = [(json.dumps(list(key)),) for key, expires in pending.items() if expires is None]
+        with self._connection_lock:
+            try:
+                self._connection.executemany("INSERT OR REPLACE INTO dedup (key, expires) VALUES (?, ?)", inserts)
+                self._connection.executemany("DELETE FROM dedup WHERE key = ?", deletes)
+                self._connection.commit()
+            except sqlite3.Error as exception:
+                logger.error(f"Could not write {len(pending)} dedup entries to {self.path}: {exception}")
+
+
+    def close(self):
+        with self._pending_lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._stop.set()
+        self._thread.join()
+        self._flush()
+        with self._connection_lock:
+            self._connection.close()
+
+
+class DedupStore:
+    """
+    Remembers handled keys with a sliding time to live and a size cap.
+
+    An entry expires ttl seconds after it was last seen. Because seeing an entry also makes
+    it the most recently used, the oldest entry is always the first to expire, so both the
+    TTL cleanup and the LRU eviction take entries from the front in O(1). With a backend the
+    entries are persisted and loaded again on start.
+
+    Parameters
+    ----------
+    ttl - Seconds an entry is remembered after it was last seen.
+    maxsize - The maximum number of entries, the least recently seen are evicted first.
+    backend - Optional persistence, e.g. SqliteDedupBackend.
+
+    Usage
+    ----------
+    dedup_store = DedupStore()
+    if dedup_store.check_and_add((address, condition_id, event_id)):
+        return  # Already handled
+    """
+
+    def __init__(self, ttl: float = DEDUP_TTL, maxsize: int = DEDUP_MAX_SIZE, backend: Optional[Any] = None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.backend = backend
+        self._entries: "OrderedDict[Hashable, float]" = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+        if backend is not None:
+            for key, expires in backend.load(time.time()):
+                self._entries[key] = expires
+            self._evict()
+
+
+    def check_and_add(self, key: Hashable) -> bool:
+        """
+        Returns True if the key has been seen within the TTL, else remembers it and returns False.
+        """
+        now = time.time()
+        self._expire(now)
+
+        seen = key in self._entries
+        if seen:
+            self._stats["hits"] += 1
+            self._entries.move_to_end(key)
+        else:
+            self._stats["misses"] += 1
+
+        expires = now + self.ttl
+        self._entries[key] = expires
+        if self.backend is not None:
+            self.backend.add(key, expires)
+
+        self._evict()
+        return seen
+
+
+    def discard(self, key: Hashable):
+        if self._entries.pop(key, None) is not None and self.backend is not None:
+            self.backend.remove(key)
+
+
+    def _expire(self, now: float):
+        while self._entries:
+            key, expires = next(iter(self._entries.items()))
+            if expires > now:
+                break
+            self._entries.popitem(last=False)
+            self._stats["expirations"] += 1
+            if self.backend is not None:
+                self.backend.remove(key)
+
+
+    def _evict(self):
+        while len(self._entries) > self.maxsize:
+            key, _ = self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+            if self.backend is not None:
+                self.backend.remove(key)
+
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the number of hits, misses, evictions and expirations, and the current size.
+        """
+        stats = dict(self._stats)
+        stats["size"] = len(self._entries)
+        return stats
+
+
+    def close(self):
+        if self.backend is not None:
+            self.backend.close()
+
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,134 @@
+"""
+This file contains the EventProcessor class, which is used to take event handling off a callback,
+like the asyncua publish callback, and process the events in batches on a pool of consumer tasks.
+"""
+
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+try:
+    from create_logger import setup_logger
+except ImportError:
+    print("The create_logger module was not found. Please make sure it is in the same directory as this script.")
+
+##############################
+EVENT_WORKERS = 4
+EVENT_QUEUE_SIZE = 10000
+EVENT_BATCH_SIZE = 100
+##############################
+
+logger = setup_logger(__name__)
+
+
+class EventProcessor:
+    """
+    Queues items and processes them in batches on a pool of consumer tasks.
+
+    Every worker has its own bounded asyncio queue and items are spread by key, so the items
+    of one key (e.g. one server) are processed in order. put() only waits when the queue of
+    that worker is full, which slows the producer down instead of losing items.
+
+    Parameters
+    ----------
+    process - The coroutine function called for every item.
+    workers - The number of consumer tasks.
+    queue_size - The maximum number of waiting items per worker.
+    batch_size - The maximum number of items a worker takes from its queue at once.
+
+    Usage
+    ----------
+    event_processor = EventProcessor(process_event)
+    await event_processor.put(address, event)
+    """
+
+    def __init__(self, process: Callable[[Any], Awaitable[Any]], workers: int = EVENT_WORKERS,
+                 queue_size: int = EVENT_QUEUE_SIZE, batch_size: int = EVENT_BATCH_SIZE):
+        self.process = process
+        self.workers = workers
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self._queues: List["asyncio.Queue[Tuple[float, Any]]"] = []
+        self._tasks: List[asyncio.Task] = []
+        self._metrics = {
+            "processed": 0,
+            "errors": 0,
+            "max_queue_depth": 0,
+            "max_latency": 0.0,
+            "total_latency": 0.0,
+        }
+
+
+    def _start(self):
+        self._queues = [asyncio.Queue(maxsize=self.queue_size) for _ in range(self.workers)]
+        self._tasks = [asyncio.create_task(self._worker(event_queue)) for event_queue in self._queues]
+
+
+    async def put(self, key: Optional[Hashable], item: Any):
+        """
+        Queues an item, starting the workers on first use.
+
+        Parameters
+        ----------
+        key - Items with the same key are processed in order.
+        item - The item passed to process.
+        """
+        if not self._tasks:
+            self._start()
+
+        event_queue = self._queues[hash(key) % self.workers]
+        await event_queue.put((time.monotonic(), item))
+
+        depth = event_queue.qsize()
+        if depth > self._metrics["max_queue_depth"]:
+            self._metrics["max_queue_depth"] = depth
+
+
+    async def _worker(self, event_queue: "asyncio.Queue[Tuple[float, Any]]"):
+        while True:
+            batch = [await event_queue.get()]
+            while len(batch) < self.batch_size and not event_queue.empty():
+                batch.append(event_queue.get_nowait())
+
+            for queued_at, item in batch:
+                try:
+                    await self.process(item)
+                except Exception as exception:
+                    self._metrics["errors"] += 1
+                    logger.error(f"Error processing event: {exception}")
+
+                latency = time.monotonic() - queued_at
+                self._metrics["processed"] += 1
+                self._metrics["total_latency"] += latency
+                if latency > self._metrics["max_latency"]:
+                    self._metrics["max_latency"] = latency
+                event_queue.task_done()
+
+
+    async def join(self):
+        """
+        Waits until every queued item has been processed.
+        """
+        for event_queue in self._queues:
+            await event_queue.join()
+
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queues = []
+
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        Returns the queue depth, the number of processed items and errors, and the mean and
+        max time from put to processed.
+        """
+        metrics = dict(self._metrics)
+        total_latency = metrics.pop("total_latency")
+        metrics["queue_depth"] = sum(event_queue.qsize() for event_queue in self._queues)
+        metrics["mean_latency"] = total_latency / metrics["processed"] if metrics["processed"] else None
+        return metrics
@@ -10,38 +10,66 @@ version: 1.0.0 Inital commit by Roberts balulis
 __version__ = "1.0.0"
 
 import asyncio
-from datetime import datetime
+import inspect
+import multiprocessing
+import queue
+import threading
+import time
 
 from asyncua import ua, Client
 import logging
-from queue import Queue
-from threading import Thread
 import json
 
 try:
     from create_logger import setup_logger
-    from opcua_client import connect_opcua
+    from opcua_client import opcua_pool, PooledSession
+    from reconnect_scheduler import reconnect_scheduler
+    from alarm_store import AlarmStore
+    from alarm_routing import RoutingTable, parse_filter
+    from dedup_store import DedupStore, SqliteDedupBackend
+    from alarm_event import AlarmEvent, extract_alarm_event
+    from event_processor import EventProcessor
+    from timer_wheel import TimerWheel
     from data_encrypt import DataEncryptor
     from config_handler import ConfigHandler
-    import asyncio
-    from concurrent.futures import ThreadPoolExecutor
+    from sms_dispatcher import SmsDispatcher, SmsCoalescer
 except ImportError:
     print(f"Some modules was not found in. Please make sure it is in the same directory as this script.")
 
 try:
     from sms_sender import send_sms
 except ImportError:
+    send_sms = None
     print(f"The sms_sender module was not found. You will not be able to send SMS messages.")
 
 ####################################
 
-# Logging
-logger_programming = setup_logger('opcua_prog_alarm')
-logger_opcua_alarm = setup_logger("opcua_alarms")
+# Logging, see _setup_loggers
+logger_programming: logging.Logger = None
+logger_opcua_alarm: logging.Logger = None
+
+
+def _setup_loggers(suffix: str = ""):
+    """
+    Sets up the loggers of this process. Shard processes pass a suffix so each one writes and
+    rotates its own log files instead of renaming the parent's.
+    """
+    global logger_programming, logger_opcua_alarm
+    logger_programming = setup_logger(f"opcua_prog_alarm{suffix}", async_mode=True)
+    logger_opcua_alarm = setup_logger(f"opcua_alarms{suffix}", async_mode=True, max_bytes=50 * 1024 * 1024,
+                                      rotate_daily=True, backup_count=90, compress=True)
+
+
+# Shard processes are spawned and import this module again. They are recognized by their process name,
+# which is set before the import, and set up their own loggers in _shard_process. Any other process,
+# including one an application starts itself, gets the default loggers
+SHARD_PROCESS_NAME = "opcua_alarm_shard"
+
+if not multiprocessing.current_process().name.startswith(f"{SHARD_PROCESS_NAME}_"):
+    _setup_loggers()
 
 # Config files
 config_manager = ConfigHandler()
-phone_book:dict = config_manager.phone_book
 opcua_alarm_config = config_manager.opcua_server_alarm_config
 
 # Config data
@@ -53,233 +81,572 @@ DAY_TRANSLATION:dict = opcua_alarm_config["day_translation"]
 OPCUA_SERVER_CRED_PATH:str = opcua_alarm_config["opcua_server_cred_path"]
 OPCUA_SERVER_WINDOWS_ENV_KEY_NAME:str = opcua_alarm_config["environment_variables"]["opcua"]
 SMS_MESSAGE:str = opcua_alarm_config["config"]["messege"]
+SMS_WORKERS:int = opcua_alarm_config["config"].get("sms_workers", 4)
+SMS_RATE:float = opcua_alarm_config["config"].get("sms_rate", 1.0)
+SMS_BURST:int = opcua_alarm_config["config"].get("sms_burst", 5)
+SMS_QUEUE_SIZE:int = opcua_alarm_config["config"].get("sms_queue_size", 1000)
+SMS_COALESCE_WINDOW:float = opcua_alarm_config["config"].get("sms_coalesce_window", 2.0)
+SMS_DIGEST_SIZE:int = opcua_alarm_config["config"].get("sms_digest_size", 3)
+DEDUP_TTL:float = opcua_alarm_config["config"].get("dedup_ttl", 7 * 24 * 3600)
+DEDUP_MAX_SIZE:int = opcua_alarm_config["config"].get("dedup_max_size", 100000)
+EVENT_WORKERS:int = opcua_alarm_config["config"].get("event_workers", 4)
+EVENT_QUEUE_SIZE:int = opcua_alarm_config["config"].get("event_queue_size", 10000)
+ALARM_PROCESSES:int = opcua_alarm_config["config"].get("processes", 1)
+SHARD_QUEUE_SIZE:int = opcua_alarm_config["config"].get("shard_queue_size", 10000)
+SHARD_SUPERVISE_INTERVAL = 5
+
+# Subscription settings, overridden by "default" and then by the server address
+# in the optional "subscription" section of opcua_server_alarm_config.json
+DEFAULT_SUBSCRIPTION_SETTINGS = {
+    "publishing_interval": 1000,
+    "lifetime_count": 400,
+    "max_keep_alive_count": 100,
+    "max_notifications_per_publish": 0,
+    "priority": 0,
+    "adaptive": False,
+    "min_publishing_interval": 250,
+    "max_publishing_interval": 5000,
+    "quiet_event_rate": 1.0,
+    "flood_event_rate": 100.0,
+    "flood_max_notifications_per_publish": 500,
+}
+ADAPT_INTERVAL = 10
+# How often the connection is checked when the keep-alives of a subscription can not be watched
+POLL_INTERVAL = 1
+# A subscription is dead when no publish response, keep-alives included, arrives within this many keep-alive periods
+KEEP_ALIVE_MARGIN = 1.5
 ####################################
 
 
+# The keep-alive deadlines of all subscriptions, see SubHandler.watch
+keep_alive_wheel = TimerWheel()
 
-executor = ThreadPoolExecutor(max_workers=1)
+# Created by init_alarm_handling, only in the process that handles the alarms
+alarm_store: AlarmStore = None
+dedup_store: DedupStore = None
+sms_dispatcher: SmsDispatcher = None
+sms_coalescer: SmsCoalescer = None
 
-sms_queue = Queue()
 
-def sms_worker():
-    while True:
-        phone_number, message = sms_queue.get()
-        send_sms(phone_number, message)
-        sms_queue.task_done()
+def format_sms_digest(alarms: list, remaining: int) -> str:
+    """
+    Formats the SMS for one or more alarms, see SmsCoalescer.
+    """
+    message = f"{SMS_MESSAGE} " + "; ".join(f"{alarm_message}, allvarlighetsgrad: {severity}"
+                                            for alarm_message, severity in alarms)
+    if remaining:
+        message += f" (+{remaining} fler larm)"
+    return message
 
 
-# Start the SMS worker thread.
-Thread(target=sms_worker, daemon=True).start()
+def init_alarm_handling():
+    """
+    Opens the alarm store and the dedup store and starts the SMS worker threads.
+
+    Runs on first use in the process that handles the alarms. Shard processes only forward
+    AlarmEvents, so they never open these files or start these threads.
+    """
+    global alarm_store, dedup_store, sms_dispatcher, sms_coalescer
+
+    if alarm_store is not None:
+        return
+
+    alarm_store = AlarmStore()
 
+    # Handled alarms, persisted so a restart followed by ConditionRefresh does not notify everyone again
+    dedup_store = DedupStore(DEDUP_TTL, DEDUP_MAX_SIZE,
+                             SqliteDedupBackend(config_manager.output_path / "alarms" / "alarm_dedup.sqlite3"))
 
-async def subscribe_to_server(adresses: str, username: str, password: str):
+    if send_sms is not None:
+        sms_dispatcher = SmsDispatcher(send_sms, workers=SMS_WORKERS, rate=SMS_RATE,
+                                       burst=SMS_BURST, queue_size=SMS_QUEUE_SIZE)
+        sms_coalescer = SmsCoalescer(sms_dispatcher.submit, format_sms_digest,
+                                     window=SMS_COALESCE_WINDOW, top_n=SMS_DIGEST_SIZE)
+
+
+def close_alarm_handling():
+    """
+    Commits the dedup store and flushes the alarm store.
+    """
+    if dedup_store is not None:
+        dedup_store.close()
+    if alarm_store is not None:
+        alarm_store.stop()
+
+
+async def subscribe_to_server(adresses: str, username: str, password: str, forward=None):
     """
     Parameters
     ----------
     adresses - The address of the OPC UA server
     username - The username to use when connecting to the OPC UA server
     password - The password to use when connecting to the OPC UA server
+    forward - Optional function that gets every AlarmEvent instead of this process handling it, see SubHandler
     """
-    subscribing_params = ua.CreateSubscriptionParameters()
-    subscribing_params.RequestedPublishingInterval = 1000
-    subscribing_params.RequestedLifetimeCount = 400
-    subscribing_params.RequestedMaxKeepAliveCount = 100
-    subscribing_params.MaxNotificationsPerPublish = 0
-    subscribing_params.PublishingEnabled = True
-    subscribing_params.Priority = 0
-
+    # The watchdog has its own reconnect state for the same server
+    reconnect_key = ("alarm", adresses)
+    session: PooledSession = opcua_pool.acquire(adresses, username, password)
     client:Client = None
     sub = None
-    while True:
+    try:
+        while True:
 
-        try:
-            if client is None:
-                client = await connect_opcua(adresses, username, password)
+            try:
+                # Read on every connect, so a reloaded opcua_server_alarm_config.json applies from the next one
+                settings = subscription_settings(adresses)
+                subscribing_params = subscription_parameters(settings)
 
-            async with client as client:
-                await client.check_connection()
+                client = await session.get_client()
 
                 conditionType = client.get_node("ns=0;i=2782")
                 alarmConditionType = client.get_node("ns=0;i=2915")
                 server_node = client.get_node(ua.NodeId(Identifier=2253,
                                                     NodeIdType=ua.NodeIdType.Numeric, NamespaceIndex=0))
 
-                msclt = SubHandler(adresses)
-                sub = await client.create_subscription(subscribing_params, msclt)
-                handle = await sub.subscribe_alarms_and_conditions(server_node, alarmConditionType)
-                await conditionType.call_method("0:ConditionRefresh", ua.Variant(sub.subscription_id, ua.VariantType.UInt32))
+                msclt = SubHandler(adresses, forward)
 
-                logger_programming.info("Made a new subscription")
+                polling = False
 
-                while True:
+                adaptive = None
+                if settings["adaptive"]:
+                    adaptive = AdaptivePublishing(adresses, settings, msclt)
+
+                async def subscribe():
+                    nonlocal polling
+                    new_sub = await client.create_subscription(subscribing_params, msclt)
                     try:
-                        await asyncio.sleep(1)
-                        await client.check_connection()
+                        await new_sub.subscribe_alarms_and_conditions(server_node, alarmConditionType)
+                        await conditionType.call_method("0:ConditionRefresh", ua.Variant(new_sub.subscription_id, ua.VariantType.UInt32))
+
+                        # The keep-alive deadline is armed with the values revised by the server, see SubHandler.arm
+                        polling = not msclt.watch(client, new_sub)
+                        if adaptive is not None:
+                            await adaptive.apply(new_sub, adaptive.interval, adaptive.max_notifications)
+                        elif not polling:
+                            msclt.arm(await revise_subscription(new_sub))
+                    except Exception:
+                        msclt.unwatch()
+                        # The session outlives this task's retries, do not leave a second subscription on it
+                        try:
+                            await new_sub.delete()
+                        except Exception:
+                            pass
+                        raise
+                    return new_sub
 
-                        if not client.uaclient._publish_task or client.uaclient._publish_task.done():
-                            logger_programming('Detected dead publish task, rebuilding...')
-                            sub = await client.create_subscription(subscribing_params, msclt)
-                            handle = await sub.subscribe_alarms_and_conditions(server_node, alarmConditionType)
-                            logger_programming("Subscription rebuilt successfully.")
-
-                    except (ConnectionError, ua.UaError) as e:
-                        logger_programming.warning(f"{e} Reconnecting in 30 seconds")
-                        if client is not None:
-                            await client.delete_subscriptions(sub)
-                            await client.disconnect()
-                            client = None
-                        await asyncio.sleep(30)
-
-        except (ConnectionError, ua.UaError) as e:
-            logger_programming.warning(f"{e} Reconnecting in 30 seconds")
-            if client is not None and sub is not None:
                 try:
-                    await client.delete_subscriptions(sub)
-                    await client.disconnect()
-                except:
-                    pass
+                    sub = await subscribe()
+                    logger_programming.info("Made a new subscription")
+                    reconnect_scheduler.record_success(reconnect_key)
+
+                    # Sleep until the subscription misses its keep-alive deadline or reports a bad status,
+                    # waking every ADAPT_INTERVAL only when the publishing is adaptive. Without keep-alives
+                    # to watch, wake every POLL_INTERVAL and check the connection and the publish task instead
+                    while True:
+                        if polling:
+                            timeout = POLL_INTERVAL
+                        else:
+                            timeout = ADAPT_INTERVAL if adaptive is not None else None
+                        reason = await msclt.wait_dead(timeout)
+
+                        if reason is None and polling:
+                            await client.check_connection()
+                            if hasattr(client.uaclient, "_publish_task"):
+                                publish_task = client.uaclient._publish_task
+                                if not publish_task or publish_task.done():
+                                    reason = "Dead publish task"
+
+                        if reason is None:
+                            if adaptive is not None:
+                                await adaptive.update(sub)
+                            continue
+
+                        logger_programming.warning(f"{reason} on the subscription to {adresses}, rebuilding...")
+                        await client.check_connection()
+                        old_sub, sub = sub, None
+                        try:
+                            await old_sub.delete()
+                        except Exception:
+                            pass
+                        sub = await subscribe()
+                        logger_programming.info("Subscription rebuilt successfully.")
+                finally:
+                    msclt.unwatch()
+
+            except (ConnectionError, ua.UaError) as e:
+                delay = reconnect_scheduler.record_failure(reconnect_key)
+                logger_programming.warning(f"{e} Reconnecting in {delay:.1f} seconds")
+                await drop_subscription(session, client, sub)
                 client = None
-            await asyncio.sleep(30)
+                sub = None
+                await reconnect_scheduler.wait(reconnect_key)
 
-        except Exception as e:
-            logger_programming.error(f"Error connecting or subscribing to server {adresses}: {e}")
-            if client is not None and sub is not None:
-                try:
-                    await client.delete_subscriptions(sub)
-                    await client.disconnect()
-                except:
-                    pass
-            client = None
-            await asyncio.sleep(30)
+            except Exception as e:
+                delay = reconnect_scheduler.record_failure(reconnect_key)
+                logger_programming.error(f"Error connecting or subscribing to server {adresses}: {e} Reconnecting in {delay:.1f} seconds")
+                await drop_subscription(session, client, sub)
+                client = None
+                sub = None
+                await reconnect_scheduler.wait(reconnect_key)
+    finally:
+        await opcua_pool.release(session)
+
+
+def subscription_settings(address: str) -> dict:
+    """
+    Returns the subscription settings for a server, see DEFAULT_SUBSCRIPTION_SETTINGS.
+    """
+    subscription_config = opcua_alarm_config.get("subscription", {})
+    settings = dict(DEFAULT_SUBSCRIPTION_SETTINGS)
+    settings.update(subscription_config.get("default", {}))
+    settings.update(subscription_config.get(address, {}))
+    return settings
+
+
+def subscription_parameters(settings: dict) -> ua.CreateSubscriptionParameters:
+    """
+    Returns the parameters to create a subscription with the settings of subscription_settings.
+    """
+    subscribing_params = ua.CreateSubscriptionParameters()
+    subscribing_params.RequestedPublishingInterval = settings["publishing_interval"]
+    subscribing_params.RequestedLifetimeCount = settings["lifetime_count"]
+    subscribing_params.RequestedMaxKeepAliveCount = settings["max_keep_alive_count"]
+    subscribing_params.MaxNotificationsPerPublish = settings["max_notifications_per_publish"]
+    subscribing_params.PublishingEnabled = True
+    subscribing_params.Priority = settings["priority"]
+    return subscribing_params
+
+
+class AdaptivePublishing:
+    """
+    Adjusts the publishing interval and notifications per publish of an alarm subscription
+    to the observed event rate.
+
+    At or below quiet_event_rate events per second the subscription publishes every
+    min_publishing_interval ms for low latency. At or above flood_event_rate it publishes every
+    max_publishing_interval ms with at most flood_max_notifications_per_publish notifications,
+    which bounds the CPU and network use. In between the interval is interpolated. The keep-alive
+    and lifetime counts are scaled so the keep-alive period stays the same as configured.
+    """
+
+    def __init__(self, address: str, settings: dict, handler: "SubHandler"):
+        self.address = address
+        self.settings = settings
+        self.handler = handler
+        # The last requested interval. Servers may clamp it, so the revised interval is only
+        # used for the keep-alive deadline, else a clamped interval would be requested again every ADAPT_INTERVAL
+        self.interval = settings["publishing_interval"]
+        self.max_notifications = settings["max_notifications_per_publish"]
+        self._events = handler.event_count
+        self._since = time.monotonic()
+
+
+    async def apply(self, sub, interval: float, max_notifications: int):
+        """
+        Modifies the subscription, logs the values revised by the server and moves the
+        keep-alive deadline of the handler to the revised keep-alive period.
+        """
+        keep_alive_period = self.settings["publishing_interval"] * self.settings["max_keep_alive_count"]
+        keep_alive_count = max(1, round(keep_alive_period / interval))
+        lifetime_ratio = self.settings["lifetime_count"] / self.settings["max_keep_alive_count"]
+
+        params = ua.ModifySubscriptionParameters()
+        params.SubscriptionId = sub.subscription_id
+        params.RequestedPublishingInterval = interval
+        params.RequestedMaxKeepAliveCount = keep_alive_count
+        params.RequestedLifetimeCount = max(3 * keep_alive_count, round(keep_alive_count * lifetime_ratio))
+        params.MaxNotificationsPerPublish = max_notifications
+        params.Priority = self.settings["priority"]
+
+        result = await sub.update(params)
+        self.interval = interval
+        self.max_notifications = max_notifications
+        self.handler.arm(result)
+        logger_programming.info(f"Subscription to {self.address} revised to publishing interval "
+                                f"{result.RevisedPublishingInterval} ms, keep-alive count {result.RevisedMaxKeepAliveCount}, "
+                                f"lifetime count {result.RevisedLifetimeCount}, max notifications {max_notifications}")
+
+
+    async def update(self, sub):
+        """
+        Measures the event rate every ADAPT_INTERVAL seconds and modifies the subscription when
+        the wanted interval differs by more than 20 percent from the last requested one.
+        """
+        now = time.monotonic()
+        elapsed = now - self._since
+        if elapsed < ADAPT_INTERVAL:
+            return
+
+        rate = (self.handler.event_count - self._events) / elapsed
+        self._events = self.handler.event_count
+        self._since = now
+
+        quiet_rate = self.settings["quiet_event_rate"]
+        flood_rate = self.settings["flood_event_rate"]
+        min_interval = self.settings["min_publishing_interval"]
+        max_interval = self.settings["max_publishing_interval"]
+
+        if rate <= quiet_rate:
+            interval = min_interval
+        elif rate >= flood_rate:
+            interval = max_interval
+        else:
+            interval = min_interval + (max_interval - min_interval) * (rate - quiet_rate) / (flood_rate - quiet_rate)
+
+        if rate >= flood_rate:
+            max_notifications = self.settings["flood_max_notifications_per_publish"]
+        else:
+            max_notifications = self.settings["max_notifications_per_publish"]
+
+        if abs(interval - self.interval) > 0.2 * self.interval or max_notifications != self.max_notifications:
+            logger_programming.info(f"Event rate from {self.address} is {rate:.1f}/s, adapting the subscription")
+            await self.apply(sub, interval, max_notifications)
+
+
+async def revise_subscription(sub) -> ua.ModifySubscriptionResult:
+    """
+    Requests the current parameters of a subscription again and returns the values revised by the server.
+    asyncua's create_subscription does not return the result of the CreateSubscription call.
+    """
+    params = ua.ModifySubscriptionParameters()
+    params.SubscriptionId = sub.subscription_id
+    params.RequestedPublishingInterval = sub.parameters.RequestedPublishingInterval
+    params.RequestedLifetimeCount = sub.parameters.RequestedLifetimeCount
+    params.RequestedMaxKeepAliveCount = sub.parameters.RequestedMaxKeepAliveCount
+    params.MaxNotificationsPerPublish = sub.parameters.MaxNotificationsPerPublish
+    params.Priority = sub.parameters.Priority
+    return await sub.update(params)
+
+
+async def drop_subscription(session: PooledSession, client: Client, sub):
+    """
+    Delete a broken subscription and mark the shared session unhealthy, so it is
+    reconnected on next use instead of being disconnected under the other users.
+    """
+    if client is not None and sub is not None:
+        try:
+            await sub.delete()
+        except Exception:
+            pass
+    if client is not None and session.client is client:
+        session.mark_unhealthy()
 
 
 class SubHandler:
     """
     Handles the events received from the OPC UA server, and what to do with them.
+
+    Events are put on the event queue and handled by handle_alarm. With forward set, e.g. in a
+    shard process, each event is extracted into an AlarmEvent and passed to forward instead.
     """
 
-    def __init__(self, address: str):
+    def __init__(self, address: str, forward=None):
         self.address = address
-        self.recurring_alarms = set()
+        self.forward = forward
+        self.event_count = 0
+        self.dead_reason = None
+        self._dead = asyncio.Event()
+        self._watching = False
+
+    def watch(self, client: Client, sub) -> bool:
+        """
+        Watches the publish responses of a subscription, the deadline itself is started by arm.
+
+        Every publish response of the subscription, keep-alives included, moves the deadline one
+        keep-alive period out, so the wheel only fires when the server has gone quiet for longer.
+
+        Keep-alives never reach the handler, only the subscription's publish_callback sees them, and
+        asyncua calls the bound method it registered for the subscription id rather than the attribute.
+        If that registration can not be found, e.g. after an asyncua update, nothing is wrapped and
+        False is returned, the caller then has to poll the connection instead.
+        """
+        self._dead.clear()
+        self.unwatch()
+
+        publish_callbacks = getattr(client.uaclient, "_subscription_callbacks", None)
+        if not isinstance(publish_callbacks, dict) or sub.subscription_id not in publish_callbacks:
+            logger_programming.warning(f"Can not watch the keep-alives of the subscription to {self.address}, "
+                                       "falling back to polling the connection")
+            return False
+
+        publish_callback = publish_callbacks[sub.subscription_id]
+
+        async def keep_alive_callback(publish_result):
+            keep_alive_wheel.reset(self)
+            result = publish_callback(publish_result)
+            if inspect.isawaitable(result):
+                await result
+
+        sub.publish_callback = keep_alive_callback
+        publish_callbacks[sub.subscription_id] = keep_alive_callback
+        self._watching = True
+        return True
+
+    def arm(self, revised: ua.ModifySubscriptionResult):
+        """
+        Starts or moves the keep-alive deadline of the watched subscription on the shared timer wheel.
+        The requested values are not used, a server that revises them upward would otherwise
+        be declared dead before its first keep-alive is due.
+        """
+        if not self._watching:
+            return
+        timeout = revised.RevisedPublishingInterval * revised.RevisedMaxKeepAliveCount / 1000 * KEEP_ALIVE_MARGIN
+        keep_alive_wheel.schedule(self, timeout,
+                                  lambda: self._set_dead(f"No keep-alive within {timeout:.0f} seconds"))
+
+    def unwatch(self):
+        self._watching = False
+        keep_alive_wheel.cancel(self)
+
+    def _set_dead(self, reason: str):
+        self.dead_reason = reason
+        self._dead.set()
+
+    async def wait_dead(self, timeout: float = None):
+        """
+        Waits until the subscription is dead and returns the reason, or None after timeout seconds.
+        """
+        try:
+            await asyncio.wait_for(self._dead.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        self._dead.clear()
+        return self.dead_reason
 
     def status_change_notification(self, status: ua.StatusChangeNotification):
         """
         Called when a status change notification is received from the server.
+        A bad status, e.g. BadTimeout when the server has dropped the subscription, marks it dead.
         """
-        # Handle the status change event. This could be logging the change, raising an alert, etc.
         logger_opcua_alarm.info(status)
+        if not status.Status.is_good():
+            self._set_dead(f"Status change {status.Status}")
 
 
     async def event_notification(self, event):
         """
         This function is called when an event is received from the OPC UA server.
-        and saves it to a log file.
-        returns: the event message
+        It only queues the event, so the publish loop is not held up by the processing.
         """
-
-        opcua_alarm_message = {
-            "New event received from": self.address
-        }
-
-        attributes_to_check = [
-            "Message", "Time", "Severity", "SuppressedOrShelved",
-            "AckedState", "ConditionClassId", "NodeId", "Quality", "Retain",
-            "ActiveState", "EnabledState"
-        ]
-
-        for attribute in attributes_to_check:
-            if hasattr(event, attribute):
-                value = getattr(event, attribute)
-                if hasattr(value, "Text"):
-                    value = value.Text
-                opcua_alarm_message[attribute] = value
-
-        if hasattr(event, "NodeId") and hasattr(event.NodeId, "Identifier"):
-            opcua_alarm_message["Identifier"] = str(event.NodeId.Identifier)
-
-
-        if opcua_alarm_message["Message"]:
-            if opcua_alarm_message["Message"] in self.recurring_alarms:
-                if opcua_alarm_message["AckedState"] == "Unacknowledged":
-                    return
-                elif opcua_alarm_message["AckedState"] == "Acknowledged":
-                    self.recurring_alarms.remove(opcua_alarm_message["Message"])
-                    return
-            else:
-                self.recurring_alarms.add(opcua_alarm_message["Message"])
-
-        if SEND_SMS and opcua_alarm_message["ActiveState"] == "Active":
-            await self.user_notification(opcua_alarm_message["Message"], opcua_alarm_message['Severity'])
-            logger_opcua_alarm.info(f"New event received from {self.address}: {opcua_alarm_message}")
+        self.event_count += 1
+        if self.forward is not None:
+            self.forward(extract_alarm_event(event, self.address))
         else:
-            if opcua_alarm_message["ActiveState"] == "Active":
-                logger_opcua_alarm.info(f"New event received from {self.address}: {opcua_alarm_message}")
+            await event_processor.put(self.address, (self.address, event))
 
 
-    async def user_notification(self, opcua_alarm_message:str, severity:int):
-        tasks = []
-        current_time = datetime.now().time()
-        current_day = datetime.now().strftime('%A')
-        translated_day = DAY_TRANSLATION[current_day]
+async def handle_alarm(alarm: AlarmEvent):
+    """
+    Dedups an alarm, notifies the users and saves it to the log files.
+    """
+    init_alarm_handling()
 
-        for user in phone_book:
-            if user.get('Active') == 'Yes':
-                user_settings = user.get('timeSettings', [])
+    # The same event delivered again, e.g. by ConditionRefresh after a reconnect or restart
+    if alarm.EventId is not None:
+        if dedup_store.check_and_add((alarm.address, alarm.ConditionId, alarm.EventId)):
+            return
 
-                for setting in user_settings:
-                    if translated_day in setting.get('days', []):
-                        start_time = datetime.strptime(setting.get('startTime', '00:00'), '%H:%M').time()
-                        end_time = datetime.strptime(setting.get('endTime', '00:00'), '%H:%M').time()
+    # A condition that has already been notified is quiet until it is acknowledged
+    if alarm.Message:
+        condition_key = (alarm.address, alarm.ConditionId)
+        if dedup_store.check_and_add(condition_key):
+            if alarm.AckedState == "Unacknowledged":
+                return
+            elif alarm.AckedState == "Acknowledged":
+                dedup_store.discard(condition_key)
+                return
 
-                        if start_time <= current_time <= end_time:
-                            lowest_severity = int(setting.get('lowestSeverity', 0))
-                            highest_severity = int(setting.get('highestSeverity', 100))
+    if alarm.ActiveState == "Active":
+        if SEND_SMS:
+            await user_notification(alarm.Message, alarm.Severity)
+        logger_opcua_alarm.info(f"New event received from {alarm.address}: {alarm}")
+        alarm_store.append(alarm)
 
-                            if min(lowest_severity, highest_severity) <= severity <= max(lowest_severity, highest_severity):
 
-                                phone_number = user.get('phone_number')
-                                name = user.get('Name')
-                                message = f"{SMS_MESSAGE} {opcua_alarm_message}, allvarlighetsgrad: {severity}"
+async def user_notification(opcua_alarm_message:str, severity:int):
+    if sms_coalescer is None:
+        logger_programming.error("Can not send SMS, the sms_sender module was not found")
+        return
 
-                                word_filter = setting.get('wordFilter', '')
+    for phone_number, name in get_routing_table().route(opcua_alarm_message, severity):
+        sms_coalescer.add(phone_number, opcua_alarm_message, severity)
+        logger_opcua_alarm.info(f"Sent SMS to {name}")
 
-                                if word_filter:
-                                    include_words, exclude_words = parse_filter(word_filter)
-                                    alarm_message_lower = opcua_alarm_message.lower()
 
-                                    if (any(word in alarm_message_lower for word in include_words) and
-                                        not any(word in alarm_message_lower for word in exclude_words)):
+async def _process_queued_event(item):
+    # Shard processes send extracted AlarmEvents, SubHandler queues raw (address, event) pairs
+    if not isinstance(item, AlarmEvent):
+        address, event = item
+        item = extract_alarm_event(event, address)
+    await handle_alarm(item)
 
-                                        sms_queue.put((phone_number, message))
-                                        logger_opcua_alarm.info(f"Sent SMS to {name}")
-                                        break
 
-                                else:
-                                    sms_queue.put((phone_number, message))
-                                    logger_opcua_alarm.info(f"Sent SMS to {name}")
-                                    break
+# Events are processed in order per server on a pool of consumer tasks
+event_processor = EventProcessor(_process_queued_event, workers=EVENT_WORKERS, queue_size=EVENT_QUEUE_SIZE)
 
 
-def parse_filter(filter_str):
-    # Split the filter string into include and exclude lists
-    parts = filter_str.split('.')
-    include_words = []
-    exclude_words = []
+_routing_table: RoutingTable = None
+
+
+def get_routing_table() -> RoutingTable:
+    """
+    Returns the phone book compiled into a RoutingTable. After watch_config it is swapped
+    for a new one every time phone_book.json changes.
+    """
+    global _routing_table
+
+    if _routing_table is None:
+        _routing_table = RoutingTable(config_manager.get_config_data("phone_book.json", frozen=True), DAY_TRANSLATION)
+        logger_programming.info("Compiled the phone book into a routing table")
+
+    return _routing_table
 
-    for part in parts:
-        if part.startswith('"') and part.endswith('"'):
-            include_words.append(part[1:-1].lower())  # Add phrase without quotes
-        elif part.startswith('-'):
-            exclude_words.append(part[1:].lower())  # Add word without minus
-        else:
-            include_words.append(part.lower())
 
-    return include_words, exclude_words
+def _reload_phone_book(phone_book_view):
+    global _routing_table
+    _routing_table = RoutingTable(phone_book_view, DAY_TRANSLATION)
+    logger_programming.info("Phone book changed, compiled a new routing table")
 
 
-async def monitor_alarms():
+def _reload_alarm_config(alarm_config):
     """
-    Reads the OPC UA server config file and starts a subscription to each server.
+    Swaps in the settings of a changed opcua_server_alarm_config.json. The worker, queue and
+    process settings only take effect after a restart. New subscription settings are read by
+    subscribe_to_server the next time it connects to a server, a running subscription keeps its settings.
+    """
+    global opcua_alarm_config, SEND_SMS, SMS_MESSAGE, DAY_TRANSLATION, _routing_table
+
+    try:
+        send_sms_enabled = alarm_config["config"]["send_sms"]
+        sms_message = alarm_config["config"]["messege"]
+        day_translation = alarm_config["day_translation"]
+        routing_table = RoutingTable(config_manager.get_config_data("phone_book.json", frozen=True), day_translation)
+    except (KeyError, TypeError, OSError, ValueError) as exception:
+        logger_programming.error(f"Invalid opcua_server_alarm_config.json, keeping the old settings: {exception}")
+        return
+
+    opcua_alarm_config = alarm_config
+    SEND_SMS = send_sms_enabled
+    SMS_MESSAGE = sms_message
+    DAY_TRANSLATION = day_translation
+    _routing_table = routing_table
+    logger_programming.info(f"Alarm config changed, send_sms is {SEND_SMS}")
+
+
+def watch_config():
+    """
+    Reloads the phone book and the alarm config when their files change, without touching the subscriptions.
+
+    Only the process that handles the alarms watches the files. Shard processes read the config
+    when they start, so changed subscription settings reach their servers when a shard is restarted.
+    """
+    config_manager.subscribe("phone_book.json", _reload_phone_book)
+    config_manager.subscribe("opcua_server_alarm_config.json", _reload_alarm_config)
+
+
+def read_server_config() -> dict:
+    """
+    Decrypts and returns the OPC UA server config.
     """
 
     data_encrypt = DataEncryptor()
@@ -289,19 +656,116 @@ async def monitor_alarms():
         logger_programming.error("Could not read OPC UA config file")
         raise FileNotFoundError("Could not read OPC UA config file")
 
-    tasks = []
+    return opcua_config
+
+
+async def monitor_alarms(processes: int = ALARM_PROCESSES):
+    """
+    Reads the OPC UA server config file and starts a subscription to each server.
+
+    Parameters
+    ----------
+    processes - With more than 1 the servers are split over this many shard processes, see monitor_alarms_sharded.
+    """
+
+    init_alarm_handling()
+    watch_config()
+
+    try:
+        if processes > 1:
+            await monitor_alarms_sharded(processes)
+            return
+
+        opcua_config = read_server_config()
+
+        tasks = []
+
+        for server in opcua_config["servers"]:
+            encrypted_username = server["username"]
+            encrypted_password = server["password"]
+            encrypted_address = server["address"]
+
+            tasks.append(asyncio.create_task(subscribe_to_server(encrypted_address,
+                                                                encrypted_username, encrypted_password)))
+
+        await asyncio.gather(*tasks)
+    finally:
+        close_alarm_handling()
+
+
+def _shard_process(index: int, servers: list, alarm_queue):
+    """
+    Entry point of a shard process. Subscribes to its servers on its own event loop and
+    forwards every AlarmEvent to the parent process. It logs to its own opcua_*_shard_<index> files.
+    """
+    _setup_loggers(f"_shard_{index}")
+
+    def forward(alarm: AlarmEvent):
+        try:
+            alarm_queue.put_nowait(alarm)
+        except queue.Full:
+            logger_programming.error(f"Alarm queue to the parent process is full, dropped alarm from {alarm.address}")
+
+    async def subscribe_all():
+        await asyncio.gather(*(subscribe_to_server(server["address"], server["username"], server["password"], forward)
+                               for server in servers))
 
-    for server in opcua_config["servers"]:
-        encrypted_username = server["username"]
-        encrypted_password = server["password"]
-        encrypted_address = server["address"]
+    asyncio.run(subscribe_all())
 
-        tasks.append(asyncio.create_task(subscribe_to_server(encrypted_address,
-                                                            encrypted_username, encrypted_password)))
 
-    await asyncio.gather(*tasks)
+def _read_shard_queue(alarm_queue, loop: asyncio.AbstractEventLoop):
+    """
+    Moves the AlarmEvents from the shard processes onto the event queue of the parent's event loop.
+    """
+    while True:
+        alarm = alarm_queue.get()
+        asyncio.run_coroutine_threadsafe(event_processor.put(alarm.address, alarm), loop).result()
+
+
+async def monitor_alarms_sharded(processes: int):
+    """
+    Splits the OPC UA servers over shard processes, each with its own event loop, so decoding
+    the publish responses is spread over several CPU cores.
+
+    The shards send the extracted AlarmEvents to this process over a multiprocessing queue,
+    so dedup, logging and SMS routing stay in one place. A shard process that dies is started again.
+
+    Parameters
+    ----------
+    processes - The number of shard processes.
+    """
+
+    opcua_config = read_server_config()
+    servers = opcua_config["servers"]
+    shards = [servers[index::processes] for index in range(processes)]
+    shards = [shard for shard in shards if shard]
+
+    context = multiprocessing.get_context("spawn")
+    alarm_queue = context.Queue(maxsize=SHARD_QUEUE_SIZE)
+
+    def start_shard(index: int):
+        process = context.Process(target=_shard_process, args=(index, shards[index], alarm_queue),
+                                  name=f"{SHARD_PROCESS_NAME}_{index}", daemon=True)
+        process.start()
+        logger_programming.info(f"Started shard {index} with {len(shards[index])} servers, pid {process.pid}")
+        return process
+
+    shard_processes = [start_shard(index) for index in range(len(shards))]
+
+    threading.Thread(target=_read_shard_queue, args=(alarm_queue, asyncio.get_running_loop()),
+                     name="shard_queue_reader", daemon=True).start()
+
+    try:
+        while True:
+            await asyncio.sleep(SHARD_SUPERVISE_INTERVAL)
+            for index, process in enumerate(shard_processes):
+                if not process.is_alive():
+                    logger_programming.error(f"Shard {index} exited with code {process.exitcode}, restarting it")
+                    shard_processes[index] = start_shard(index)
+    finally:
+        for process in shard_processes:
+            process.terminate()
 
 
 if __name__ == "__main__":
     asyncio.run(monitor_alarms())
-
@@ -1,9 +1,33 @@
+import asyncio
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+import weakref
+
 from asyncua import Client, ua, Node
+from asyncua.common.ua_utils import data_type_to_variant_type
 
 from create_logger import setup_logger
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 ##############################
 CLIENT_TIMEOUT = 10
+MAX_NODES_PER_REQUEST = 500
+NODE_CACHE_SIZE = 1000
+NAMESPACE_CHECK_INTERVAL = 60
+SUBSCRIPTION_QUEUE_SIZE = 1000
+##############################
+
+# Overflow policies for subscribe_tags
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_COALESCE_LATEST = "coalesce_latest"
+OVERFLOW_BLOCK = "block"
+OVERFLOW_POLICIES = (OVERFLOW_DROP_OLDEST, OVERFLOW_COALESCE_LATEST, OVERFLOW_BLOCK)
 ##############################
 
 logger = setup_logger(__name__)
@@ -63,10 +87,344 @@ async def connect_opcua(url: str, username: str, password: str):
     return client
 
 
+class PooledSession:
+    """
+    One shared OPC UA session in an OpcuaPool.
+
+    The session connects lazily on the first get_client(). Every get_client() runs
+    check_connection(), also after the session has been marked unhealthy, and only
+    reconnects when that fails.
+    """
+
+    def __init__(self, url: str, username: str, password: str):
+        self.url = url
+        self.username = username
+        self.password = password
+        self.client: Optional[Client] = None
+        self.healthy = False
+        self.refcount = 0
+        self._lock = asyncio.Lock()
+
+
+    async def get_client(self) -> Client:
+        """
+        Return a connected client, reconnecting first if the connection is lost.
+        """
+        async with self._lock:
+            if self.client is not None:
+                try:
+                    await self.client.check_connection()
+                    self.healthy = True
+                except (ConnectionError, ua.UaError) as exception:
+                    logger.warning(f"Pooled session to {self.url} failed health check: {exception}")
+                    self.healthy = False
+
+            if self.client is None or not self.healthy:
+                await self._disconnect()
+                self.client = await connect_opcua(self.url, self.username, self.password)
+                _pooled_sessions[self.client] = self
+                self.healthy = True
+
+            return self.client
+
+
+    def mark_unhealthy(self):
+        self.healthy = False
+
+
+    async def _disconnect(self):
+        if self.client is None:
+            return
+        try:
+            await self.client.disconnect()
+        except Exception as exception:
+            logger.debug(f"Error disconnecting from {self.url}: {exception}")
+        self.client = None
+
+
+class OpcuaPool:
+    """
+    Shares one OPC UA session per (url, username) between alarms, watchdog and writes.
+
+    Sessions are reference counted and disconnected when the last user releases them.
+
+    Usage
+    ----------
+    session = opcua_pool.acquire(url, username, password)
+    client = await session.get_client()
+    ...
+    await opcua_pool.release(session)
+    """
+
+    def __init__(self):
+        self._sessions: Dict[Tuple[str, str], PooledSession] = {}
+
+
+    def acquire(self, url: str, username: str, password: str) -> PooledSession:
+        key = (url, username)
+        session = self._sessions.get(key)
+        if session is None:
+            session = PooledSession(url, username, password)
+            self._sessions[key] = session
+        session.refcount += 1
+        return session
+
+
+    async def release(self, session: PooledSession):
+        session.refcount -= 1
+        if session.refcount <= 0:
+            self._sessions.pop((session.url, session.username), None)
+            async with session._lock:
+                await session._disconnect()
+
+
+    @asynccontextmanager
+    async def connection(self, url: str, username: str, password: str):
+        """
+        Acquire a pooled session and yield its client for the duration of the block.
+        """
+        session = self.acquire(url, username, password)
+        try:
+            yield await session.get_client()
+        finally:
+            await self.release(session)
+
+
+    async def close(self):
+        for session in list(self._sessions.values()):
+            session.refcount = 0
+            await self.release(session)
+
+
+_pooled_sessions: "weakref.WeakKeyDictionary[Client, PooledSession]" = weakref.WeakKeyDictionary()
+
+opcua_pool = OpcuaPool()
+
+
+def _is_connection_error(exception: Exception) -> bool:
+    if isinstance(exception, ua.uaerrors.UaStringParsingError):
+        return False
+    return isinstance(exception, (ConnectionError, asyncio.TimeoutError, ua.UaError))
+
+
+async def _client_fault(client: Client, exception: Exception):
+    """
+    Handle a failed request: on a connection-level error a pooled client is marked unhealthy,
+    so the next get_client() checks the connection, any other client is disconnected.
+    Other errors, like a value that does not convert, leave the connection alone.
+    """
+    if not _is_connection_error(exception):
+        return
+
+    session = _pooled_sessions.get(client)
+    if session is None:
+        await client.disconnect()
+    elif session.client is client:
+        session.mark_unhealthy()
+
+
+def _to_bool(value):
+    if isinstance(value, bool):
+        return value
+    elif isinstance(value, str):
+        return value.lower() == "true"
+    else:
+        raise ValueError("Invalid type for conversion to bool")
+
+
+def _to_float(value):
+    return float(value)
+
+
+def _to_int(value):
+    return int(value)
+
+
+# Define data type to conversion function mapping
+CONVERSION_MAP = {
+    ua.VariantType.Boolean: _to_bool,
+    ua.VariantType.Float: _to_float,
+    ua.VariantType.Int16: _to_int,
+    ua.VariantType.Int32: _to_int,
+    ua.VariantType.Int64: _to_int,
+    ua.VariantType.UInt16: _to_int,
+    ua.VariantType.UInt32: _to_int,
+    ua.VariantType.UInt64: _to_int,
+}
+
+
+class WriteResult(NamedTuple):
+    """
+    Outcome of writing a single tag with write_tags.
+    """
+    result: str
+    fault: bool
+    status: Optional[ua.StatusCode] = None
+
+
+def _to_data_value(data_type: ua.VariantType, tag_value):
+    """
+    Convert a tag value to a DataValue of the given data type.
+
+    :param data_type: The VariantType of the node
+    :param tag_value: The value to convert
+    :return: The DataValue, or None if the value does not fit the data type
+    """
+    data_value = None
+    if data_type in CONVERSION_MAP:
+        conversion_func = CONVERSION_MAP[data_type]
+        if isinstance(tag_value, str) or isinstance(tag_value, int):
+            tag_value = conversion_func(tag_value)
+        if isinstance(tag_value, bool) or isinstance(tag_value, float) or isinstance(tag_value, int):
+            data_value = ua.DataValue(ua.Variant(tag_value, data_type))
+    elif data_type == ua.VariantType.String:
+        if isinstance(tag_value, str):
+            data_value = ua.DataValue(ua.Variant(tag_value, data_type))
+
+    return data_value
+
+
+class NodeTypeCache:
+    """
+    LRU cache of tag name to (Node, VariantType) for a single client.
+
+    A PLC tag's data type does not change within a session, so writes to a cached tag
+    skip the DataType read. The cache is cleared when the client reconnects (a new
+    socket protocol) or when the server's NamespaceArray changes, which is checked at
+    most once every NAMESPACE_CHECK_INTERVAL seconds.
+
+    The server's operation limits are kept here as well, and reread after a reconnect.
+    """
+
+    def __init__(self, maxsize: int = NODE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.operation_limits: Dict[str, int] = {}
+        self._entries: "OrderedDict[str, Tuple[Node, ua.VariantType]]" = OrderedDict()
+        self._protocol = None
+        self._namespace_array = None
+        self._namespace_checked = 0.0
+
+
+    async def validate(self, client: Client):
+        """
+        Clear the cache if the client has reconnected or the namespaces have changed.
+        """
+        protocol = client.uaclient.protocol
+        if protocol is not self._protocol:
+            self.clear()
+            self.operation_limits.clear()
+            self._protocol = protocol
+
+        now = time.monotonic()
+        if now - self._namespace_checked >= NAMESPACE_CHECK_INTERVAL:
+            namespace_node = client.get_node(ua.NodeId(ua.ObjectIds.Server_NamespaceArray, 0))
+            namespace_array = await namespace_node.read_value()
+            if self._namespace_array is not None and namespace_array != self._namespace_array:
+                logger.info("Server namespace array changed, clearing node cache")
+                self.clear()
+            self._namespace_array = namespace_array
+            self._namespace_checked = now
+
+
+    def get(self, tag_name: str) -> Optional[Tuple[Node, ua.VariantType]]:
+        entry = self._entries.get(tag_name)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(tag_name)
+        self.hits += 1
+        return entry
+
+
+    def put(self, tag_name: str, node: Node, data_type: ua.VariantType):
+        self._entries[tag_name] = (node, data_type)
+        self._entries.move_to_end(tag_name)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+    def clear(self):
+        self._entries.clear()
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_node_caches: "weakref.WeakKeyDictionary[Client, NodeTypeCache]" = weakref.WeakKeyDictionary()
+
+
+def get_node_cache(client: Client) -> NodeTypeCache:
+    """
+    Return the node data-type cache belonging to the client, creating it if needed.
+    """
+    cache = _node_caches.get(client)
+    if cache is None:
+        cache = NodeTypeCache()
+        _node_caches[client] = cache
+    return cache
+
+
+def _chunks(items: list, size: int):
+    if size <= 0:
+        size = max(len(items), 1)
+    for index in range(0, len(items), size):
+        yield items[index:index + size]
+
+
+async def _operation_limit(client: Client, limit_name: str) -> int:
+    """
+    Read one of the server's OperationLimits, e.g. MaxNodesPerRead, once per session.
+
+    :param client: The client object
+    :param limit_name: The name of the limit under ServerCapabilities/OperationLimits
+    :return: The limit, 0 if the server has none, MAX_NODES_PER_REQUEST if it could not be read
+    """
+    cache = get_node_cache(client)
+    limit = cache.operation_limits.get(limit_name)
+    if limit is None:
+        identifier = getattr(ua.ObjectIds, f"Server_ServerCapabilities_OperationLimits_{limit_name}")
+        try:
+            limit = int(await client.get_node(ua.NodeId(identifier, 0)).read_value())
+        except ua.UaError as exception:
+            logger.warning(f"Could not read {limit_name}, using {MAX_NODES_PER_REQUEST}: {exception}")
+            limit = MAX_NODES_PER_REQUEST
+        cache.operation_limits[limit_name] = limit
+
+    return limit
+
+
+async def _read_variant_types(client: Client, node_ids: List[ua.NodeId]) -> List[Optional[ua.VariantType]]:
+    """
+    Read the DataType attribute of many nodes in batched ReadRequests.
+
+    :param client: The client object
+    :param node_ids: The nodes to resolve
+    :return: The VariantType of each node, None where the read failed
+    """
+    variant_types = []
+    limit = await _operation_limit(client, "MaxNodesPerRead")
+    for chunk in _chunks(node_ids, limit):
+        data_values = await client.uaclient.read_attributes(chunk, ua.AttributeIds.DataType)
+        for data_value in data_values:
+            if data_value.StatusCode is not None and not data_value.StatusCode.is_good():
+                variant_types.append(None)
+                continue
+            # Built-in data types resolve locally without a round-trip
+            variant_types.append(await data_type_to_variant_type(client.get_node(data_value.Value.Value)))
+
+    return variant_types
+
+
 async def write_tag(client: Client, tag_name, tag_value):
     """
     Write a value to a specific tag within the client.
 
+    The node and its data type are cached per client, so repeated writes to
+    the same tag only cost the write itself.
+
     :param client: The client object
     :param tag_name: The tag name to write to
     :param tag_value: The value to write
@@ -74,78 +432,376 @@ async def write_tag(client: Client, tag_name, tag_value):
     """
     result = "Tag not found"
     fault = False
+    cache = get_node_cache(client)
 
     try:
-        node_id: Node = ua.NodeId.from_string(tag_name)
-        node: Node = client.get_node(node_id)
-
+        await cache.validate(client)
     except Exception as exeption:
         logger.error(exeption)
-        await client.disconnect()
+        await _client_fault(client, exeption)
         fault = True
         return result, fault
 
-    # Write the value to the node
-    if node_id is not None:
-        data_value = None
+    cached = cache.get(tag_name)
+    if cached is None:
         try:
+            node_id: ua.NodeId = ua.NodeId.from_string(tag_name)
+        except Exception as exeption:
+            logger.error(f"Could not parse tag {tag_name}: {exeption}")
+            fault = True
+            return result, fault
 
-            # Define conversion functions
-            def to_bool(value):
-                if isinstance(value, bool):
-                    return value
-                elif isinstance(value, str):
-                    return value.lower() == "true"
-                else:
-                    raise ValueError("Invalid type for conversion to bool")
-
-
-            def to_float(value):
-                return float(value)
-
-            def to_int(value):
-                return int(value)
-
-            # Define data type to conversion function mapping
-            conversion_map = {
-                ua.VariantType.Boolean: to_bool,
-                ua.VariantType.Float: to_float,
-                ua.VariantType.Int16: to_int,
-                ua.VariantType.Int32: to_int,
-                ua.VariantType.Int64: to_int,
-                ua.VariantType.UInt16: to_int,
-                ua.VariantType.UInt32: to_int,
-                ua.VariantType.UInt64: to_int,
-            }
-
-            # Convert tag value to data value
+        node: Node = client.get_node(node_id)
+        try:
             data_type = await node.read_data_type_as_variant_type()
-            if data_type in conversion_map:
-                conversion_func = conversion_map[data_type]
-                if isinstance(tag_value, str) or isinstance(tag_value, int):
-                    tag_value = conversion_func(tag_value)
-                if isinstance(tag_value, bool) or isinstance(tag_value, float) or isinstance(tag_value, int):
-                    data_value = ua.DataValue(ua.Variant(tag_value, data_type))
-            elif data_type == ua.VariantType.String:
-                if isinstance(tag_value, str):
-                    data_value = ua.DataValue(ua.Variant(tag_value, data_type))
-
-            result = "Tag found but no correct tag value"
         except Exception as exeption:
-            await client.disconnect()
+            logger.error(f"Error reading data type of tag {tag_name}: {exeption}")
+            await _client_fault(client, exeption)
             fault = True
-            logger.error(f"Error converting data type to ua.Variant: {exeption}")
             return result, fault
+        cache.put(tag_name, node, data_type)
+    else:
+        node, data_type = cached
+        node_id = node.nodeid
 
-        if data_value is not None:
+    # Write the value to the node
+    data_value = None
+    try:
+        # Convert tag value to data value
+        data_value = _to_data_value(data_type, tag_value)
 
-            try:
-                await node.write_value(data_value)
-                result = "Success finding tag and writing value"
-            except Exception as exeption:
-                fault = True
-                await client.disconnect()
-                logger.error(f"Error writing value to tag: {tag_name},{tag_value}, from {node_id}. {exeption}")
-                return result, fault
+        result = "Tag found but no correct tag value"
+    except Exception as exeption:
+        fault = True
+        logger.error(f"Error converting data type to ua.Variant: {exeption}")
+        return result, fault
+
+    if data_value is not None:
+
+        try:
+            await node.write_value(data_value)
+            result = "Success finding tag and writing value"
+        except Exception as exeption:
+            fault = True
+            await _client_fault(client, exeption)
+            logger.error(f"Error writing value to tag: {tag_name},{tag_value}, from {node_id}. {exeption}")
+            return result, fault
 
     return result, fault
+
+
+async def write_tags(client: Client, tags: Dict[str, Any]) -> Dict[str, WriteResult]:
+    """
+    Write values to many tags with batched requests.
+
+    Data types not already in the client's node cache are resolved with one batched
+    Read of the DataType attribute, then every value is sent in one WriteRequest
+    (chunked by the server's MaxNodesPerWrite).
+
+    :param client: The client object
+    :param tags: A dict of tag name to the value to write
+    :return: A dict of tag name to WriteResult, in the same order as tags
+    """
+    results: Dict[str, WriteResult] = {}
+    resolved: Dict[str, Tuple[ua.NodeId, Optional[ua.VariantType]]] = {}
+    missing: Dict[str, ua.NodeId] = {}
+    cache = get_node_cache(client)
+
+    try:
+        await cache.validate(client)
+    except Exception as exeption:
+        logger.error(f"Error validating node cache: {exeption}")
+        await _client_fault(client, exeption)
+        return {tag_name: WriteResult("Tag not found", True) for tag_name in tags}
+
+    for tag_name in tags:
+        cached = cache.get(tag_name)
+        if cached is not None:
+            node, data_type = cached
+            resolved[tag_name] = (node.nodeid, data_type)
+            continue
+        try:
+            missing[tag_name] = ua.NodeId.from_string(tag_name)
+        except Exception as exeption:
+            logger.error(f"Could not parse tag {tag_name}: {exeption}")
+            results[tag_name] = WriteResult("Tag not found", True)
+
+    if missing:
+        try:
+            data_types = await _read_variant_types(client, list(missing.values()))
+        except Exception as exeption:
+            logger.error(f"Error reading data types of {len(missing)} tags: {exeption}")
+            await _client_fault(client, exeption)
+            return {tag_name: WriteResult("Tag not found", True) for tag_name in tags}
+
+        for (tag_name, node_id), data_type in zip(missing.items(), data_types):
+            resolved[tag_name] = (node_id, data_type)
+            if data_type is not None:
+                cache.put(tag_name, client.get_node(node_id), data_type)
+
+    to_write: List[Tuple[str, ua.NodeId, ua.DataValue]] = []
+    for tag_name, (node_id, data_type) in resolved.items():
+        if data_type is None:
+            results[tag_name] = WriteResult("Tag not found", True)
+            continue
+
+        try:
+            data_value = _to_data_value(data_type, tags[tag_name])
+        except Exception as exeption:
+            logger.error(f"Error converting data type to ua.Variant for {tag_name}: {exeption}")
+            results[tag_name] = WriteResult("Tag found but no correct tag value", True)
+            continue
+
+        if data_value is None:
+            results[tag_name] = WriteResult("Tag found but no correct tag value", False)
+        else:
+            to_write.append((tag_name, node_id, data_value))
+
+    try:
+        limit = await _operation_limit(client, "MaxNodesPerWrite")
+    except Exception as exeption:
+        logger.error(f"Error reading MaxNodesPerWrite: {exeption}")
+        await _client_fault(client, exeption)
+        limit = MAX_NODES_PER_REQUEST
+        to_write = []
+        for tag_name in tags:
+            results.setdefault(tag_name, WriteResult("Tag found but no correct tag value", True))
+
+    for chunk in _chunks(to_write, limit):
+        try:
+            statuses = await client.uaclient.write_attributes(
+                [node_id for _, node_id, _ in chunk],
+                [data_value for _, _, data_value in chunk],
+                ua.AttributeIds.Value)
+        except Exception as exeption:
+            logger.error(f"Error writing values to {len(chunk)} tags: {exeption}")
+            await _client_fault(client, exeption)
+            for tag_name, _, _ in to_write:
+                results.setdefault(tag_name, WriteResult("Tag found but no correct tag value", True))
+            break
+
+        for (tag_name, node_id, _), status in zip(chunk, statuses):
+            if status.is_good():
+                results[tag_name] = WriteResult("Success finding tag and writing value", False, status)
+            else:
+                logger.error(f"Error writing value to tag: {tag_name},{tags[tag_name]}, from {node_id}. {status}")
+                results[tag_name] = WriteResult("Tag found but no correct tag value", True, status)
+
+    return {tag_name: results[tag_name] for tag_name in tags}
+
+
+# VariantType to NumPy dtype mapping for read_tags(as_numpy=True)
+NUMPY_DTYPES = {
+    ua.VariantType.Boolean: "bool",
+    ua.VariantType.SByte: "int8",
+    ua.VariantType.Byte: "uint8",
+    ua.VariantType.Int16: "int16",
+    ua.VariantType.UInt16: "uint16",
+    ua.VariantType.Int32: "int32",
+    ua.VariantType.UInt32: "uint32",
+    ua.VariantType.Int64: "int64",
+    ua.VariantType.UInt64: "uint64",
+    ua.VariantType.Float: "float32",
+    ua.VariantType.Double: "float64",
+}
+
+
+async def read_tags(client: Client, tag_names: List[str], as_numpy: bool = False) -> Dict[str, Any]:
+    """
+    Read the values of many tags with batched ReadRequests.
+
+    The tags are sent in as few requests as the server's MaxNodesPerRead allows.
+
+    :param client: The client object
+    :param tag_names: The tag names to read
+    :param as_numpy: Return numeric array tags as NumPy arrays instead of lists
+    :return: A dict of tag name to its value, None where the tag could not be read
+    """
+    if as_numpy and np is None:
+        raise ImportError("numpy is required for read_tags(as_numpy=True)")
+
+    results: Dict[str, Any] = {tag_name: None for tag_name in tag_names}
+    node_ids: Dict[str, ua.NodeId] = {}
+
+    for tag_name in results:
+        try:
+            node_ids[tag_name] = ua.NodeId.from_string(tag_name)
+        except Exception as exeption:
+            logger.error(f"Could not parse tag {tag_name}: {exeption}")
+
+    try:
+        await get_node_cache(client).validate(client)
+        limit = await _operation_limit(client, "MaxNodesPerRead")
+
+        for chunk in _chunks(list(node_ids.items()), limit):
+            data_values = await client.uaclient.read_attributes(
+                [node_id for _, node_id in chunk], ua.AttributeIds.Value)
+
+            for (tag_name, node_id), data_value in zip(chunk, data_values):
+                if data_value.StatusCode is not None and not data_value.StatusCode.is_good():
+                    logger.error(f"Error reading tag: {tag_name}, from {node_id}. {data_value.StatusCode}")
+                    continue
+
+                value = data_value.Value.Value
+                dtype = NUMPY_DTYPES.get(data_value.Value.VariantType)
+                if as_numpy and dtype is not None and isinstance(value, list):
+                    value = np.asarray(value, dtype=dtype)
+                results[tag_name] = value
+
+    except Exception as exeption:
+        logger.error(f"Error reading values of {len(node_ids)} tags: {exeption}")
+        await _client_fault(client, exeption)
+
+    return results
+
+
+class TagSubscription:
+    """
+    Async iterator over data changes of the tags subscribed with subscribe_tags.
+
+    Each iteration returns a batch, a list of (tag, value, source_timestamp), holding every
+    change received since the previous iteration. The buffer is bounded by queue_size and
+    the overflow policy decides what happens when it is full:
+
+    drop_oldest - the oldest buffered change is dropped.
+    coalesce_latest - the buffer is collapsed to the latest change per tag, then the oldest is dropped if still full.
+    block - the publish callback waits for the consumer, which slows down the subscription.
+    """
+
+    def __init__(self, queue_size: int = SUBSCRIPTION_QUEUE_SIZE, overflow: str = OVERFLOW_DROP_OLDEST):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {overflow}, use one of {OVERFLOW_POLICIES}")
+
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.dropped = 0
+        self.subscription = None
+        self.node_tags: Dict[ua.NodeId, str] = {}
+        self._buffer: "deque[Tuple[str, Any, Any]]" = deque()
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+        self._closed = False
+
+
+    async def datachange_notification(self, node: Node, val, data):
+        """
+        Called by asyncua for every monitored item in a publish response.
+        """
+        tag = self.node_tags.get(node.nodeid)
+        if tag is None:
+            tag = node.nodeid.to_string()
+        item = (tag, val, data.monitored_item.Value.SourceTimestamp)
+
+        if len(self._buffer) >= self.queue_size:
+            if self.overflow == OVERFLOW_BLOCK:
+                while len(self._buffer) >= self.queue_size and not self._closed:
+                    self._not_full.clear()
+                    await self._not_full.wait()
+            elif self.overflow == OVERFLOW_COALESCE_LATEST:
+                self._coalesce()
+
+            if len(self._buffer) >= self.queue_size:
+                self._buffer.popleft()
+                self.dropped += 1
+
+        self._buffer.append(item)
+        self._not_empty.set()
+
+
+    def status_change_notification(self, status: ua.StatusChangeNotification):
+        logger.info(f"Tag subscription status change: {status}")
+
+
+    def _coalesce(self):
+        latest: "OrderedDict[str, Tuple[str, Any, Any]]" = OrderedDict()
+        for item in self._buffer:
+            latest.pop(item[0], None)
+            latest[item[0]] = item
+        self.dropped += len(self._buffer) - len(latest)
+        self._buffer = deque(latest.values())
+
+
+    def __aiter__(self):
+        return self
+
+
+    async def __anext__(self) -> List[Tuple[str, Any, Any]]:
+        while not self._buffer:
+            if self._closed:
+                raise StopAsyncIteration
+            self._not_empty.clear()
+            await self._not_empty.wait()
+
+        batch = list(self._buffer)
+        self._buffer.clear()
+        self._not_full.set()
+        return batch
+
+
+    async def close(self):
+        """
+        Delete the server-side subscription and end the iteration.
+        """
+        self._closed = True
+        self._not_empty.set()
+        self._not_full.set()
+        if self.subscription is not None:
+            try:
+                await self.subscription.delete()
+            except Exception as exception:
+                logger.debug(f"Error deleting tag subscription: {exception}")
+            self.subscription = None
+
+
+    async def __aenter__(self):
+        return self
+
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+
+async def subscribe_tags(client: Client, tags: List[str], sampling_interval: float = 100,
+                         queue_size: int = SUBSCRIPTION_QUEUE_SIZE,
+                         overflow: str = OVERFLOW_DROP_OLDEST) -> TagSubscription:
+    """
+    Subscribe to data changes of many tags with server-side monitored items.
+
+    The monitored items are created in batches of the server's MaxMonitoredItemsPerCall
+    and the server publishes every sampling_interval milliseconds.
+
+    :param client: The client object
+    :param tags: The tag names to monitor
+    :param sampling_interval: Sampling and publishing interval in milliseconds
+    :param queue_size: The maximum number of buffered changes
+    :param overflow: drop_oldest, coalesce_latest or block, see TagSubscription
+    :return: A TagSubscription to iterate over with async for
+
+    Usage
+    ----------
+    async with await subscribe_tags(client, tags, 100) as stream:
+        async for batch in stream:
+            for tag, value, source_timestamp in batch:
+                ...
+    """
+    stream = TagSubscription(queue_size, overflow)
+    nodes = []
+    for tag_name in tags:
+        node_id = ua.NodeId.from_string(tag_name)
+        stream.node_tags[node_id] = tag_name
+        nodes.append(client.get_node(node_id))
+
+    try:
+        stream.subscription = await client.create_subscription(sampling_interval, stream)
+        limit = await _operation_limit(client, "MaxMonitoredItemsPerCall")
+        for chunk in _chunks(nodes, limit):
+            await stream.subscription.subscribe_data_change(chunk, sampling_interval=sampling_interval)
+
+    except Exception as exeption:
+        logger.error(f"Error subscribing to {len(nodes)} tags: {exeption}")
+        await stream.close()
+        await _client_fault(client, exeption)
+        raise exeption
+
+    return stream
@@ -1,7 +1,11 @@
-from opcua_client import connect_opcua, write_tag
+from opcua_client import opcua_pool, write_tag
+from reconnect_scheduler import reconnect_scheduler
+from timer_wheel import TimerWheel
 from create_logger import setup_logger
 from data_encrypt import DataEncryptor
 import asyncio
+from bisect import bisect_left
+import time
 from config_handler import ConfigHandler
 
 
@@ -9,30 +13,111 @@ from config_handler import ConfigHandler
 # Config files
 config_manager = ConfigHandler()
 opcua_alarm_config = config_manager.opcua_server_alarm_config
+watchdog_config = opcua_alarm_config.get("watchdog", {})
 
 # Config data
 OPCUA_SERVER_CRED_PATH:str = opcua_alarm_config["opcua_server_cred_path"]
 OPCUA_SERVER_WINDOWS_ENV_KEY_NAME:str = opcua_alarm_config["environment_variables"]["opcua"]
 
-WATCHDOG_INTERVAL = 10
+WATCHDOG_INTERVAL:float = watchdog_config.get("interval", 10)
+WATCHDOG_CONCURRENCY:int = watchdog_config.get("concurrency", 20)
+# The tag the heartbeat counter is written to, a server entry can override it with "watchdog_tag".
+# There is no default, a server without either is not watched
+WATCHDOG_TAG:str = watchdog_config.get("tag")
+WATCHDOG_COUNTER_MAX = 32767
+WATCHDOG_TICK = 0.1
+# Upper bounds in seconds of the round-trip latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
 ######################
 
 logger = setup_logger(__name__)
 
-class Watchdog:
+
+class LatencyHistogram:
     """
-    Watchdog class to monitor and maintain OPC UA server connections.
+    Counts round-trip latencies in fixed buckets, the last bucket holds everything above the largest bound.
+    """
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+
+    def snapshot(self) -> dict:
+        bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+        return {
+            "buckets": dict(zip(bounds, self.counts)),
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "max": self.max,
+        }
+
+
+class HeartbeatEndpoint:
+    """
+    The heartbeat state of one server.
     """
-    def __init__(self, url: str, username: str, password: str):
+    def __init__(self, url: str, username: str, password: str, tag: str):
         self.url = url
         self.username = username
         self.password = password
-        self.client = None
+        self.tag = tag
+        self.session = None
+        self.counter = 0
+        self.beats = 0
+        self.failures = 0
+        self.next_due = 0.0
+        self.latency = LatencyHistogram()
+
+
+class Watchdog:
+    """
+    Watchdog class to monitor and maintain OPC UA server connections.
+
+    Every server gets a heartbeat every interval seconds: an incrementing counter written to its
+    watchdog tag. All heartbeats run from one timer wheel, with the servers' phases spread evenly
+    over the interval so the PLCs are not all written at the same instant, and at most concurrency
+    writes are in flight at once. A failed heartbeat is retried after the reconnect scheduler's
+    backoff, so an endpoint is never given up on.
+    """
+    def __init__(self, interval: float = WATCHDOG_INTERVAL, concurrency: int = WATCHDOG_CONCURRENCY):
+        self.interval = interval
+        self.endpoints = {}
+        self._timer_wheel = TimerWheel(tick=WATCHDOG_TICK)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tasks = set()
+        self._stopped = None
+
+
+    def add_server(self, url: str, username: str, password: str, tag: str = WATCHDOG_TAG):
+        """
+        Add a server to the heartbeat schedule. Servers added before run are staggered.
+        A server without a watchdog tag is skipped.
+        """
+        if not tag:
+            logger.error(f"No watchdog tag configured for {url}, set watchdog.tag or the server's watchdog_tag. "
+                         "The server is not watched")
+            return
+
+        endpoint = HeartbeatEndpoint(url, username, password, tag)
+        self.endpoints[url] = endpoint
+        if self._stopped is not None:
+            self._schedule(endpoint, 0)
 
 
     async def configure_servers(self):
         """
-        Configure servers based on encrypted configuration.
+        Configure servers based on encrypted configuration and run the heartbeats.
         """
         data_encrypt = DataEncryptor()
         opcua_config = data_encrypt.encrypt_credentials(OPCUA_SERVER_CRED_PATH, OPCUA_SERVER_WINDOWS_ENV_KEY_NAME)
@@ -41,39 +126,111 @@ class Watchdog:
             logger.error("Could not read OPC UA config file")
             raise FileNotFoundError("Could not read OPC UA config file")
 
-        tasks = [self.watchdog(server["address"], server["username"], server["password"]) for server in opcua_config["servers"]]
-        await asyncio.gather(*tasks)
+        for server in opcua_config["servers"]:
+            self.add_server(server["address"], server["username"], server["password"],
+                            server.get("watchdog_tag", WATCHDOG_TAG))
+        await self.run()
 
 
-    async def watchdog(self, url: str, username: str, password: str):
+    async def run(self):
         """
-        Monitor and maintain a connection to an OPC UA server.
+        Run the heartbeats of all added servers until stop is called.
         """
+        self._stopped = asyncio.Event()
+        endpoints = list(self.endpoints.values())
+        for index, endpoint in enumerate(endpoints):
+            self._schedule(endpoint, self.interval * index / len(endpoints))
+
         try:
-            client = await connect_opcua(url, username, password)
-            async with client:
-                while True:
-                    await client.check_connection()
-                    await write_tag(client, "placeholder", 1)
-                    await asyncio.sleep(WATCHDOG_INTERVAL)
-        except Exception as e:
-            logger.error(f"Error in watchdog for {url}: {e}")
+            await self._stopped.wait()
+        finally:
+            for url in self.endpoints:
+                self._timer_wheel.cancel(url)
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            for endpoint in self.endpoints.values():
+                if endpoint.session is not None:
+                    await opcua_pool.release(endpoint.session)
+                    endpoint.session = None
+
+
+    def stop(self):
+        if self._stopped is not None:
+            self._stopped.set()
+
+
+    def _schedule(self, endpoint: HeartbeatEndpoint, delay: float):
+        endpoint.next_due = time.monotonic() + delay
+        self._timer_wheel.schedule(endpoint.url, delay, lambda: self._start_heartbeat(endpoint))
+
+
+    def _start_heartbeat(self, endpoint: HeartbeatEndpoint):
+        task = asyncio.create_task(self.heartbeat(endpoint))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+
+    async def heartbeat(self, endpoint: HeartbeatEndpoint):
+        """
+        Write the next counter value to the server's watchdog tag and schedule the next heartbeat.
+        """
+        url = endpoint.url
+        async with self._semaphore:
+            try:
+                if endpoint.session is None:
+                    endpoint.session = opcua_pool.acquire(url, endpoint.username, endpoint.password)
+                client = await endpoint.session.get_client()
+
+                counter = endpoint.counter % WATCHDOG_COUNTER_MAX + 1
+                started = time.perf_counter()
+                result, fault = await write_tag(client, endpoint.tag, counter)
+                round_trip = time.perf_counter() - started
+            except Exception as e:
+                logger.error(f"Error in watchdog for {url}: {e}")
+                fault = True
+
+        if fault:
+            endpoint.failures += 1
+            delay = reconnect_scheduler.record_failure(("watchdog", url))
+            logger.warning(f"Watchdog for {url} failed. Reconnecting in {delay:.1f} seconds")
+            self._schedule(endpoint, delay)
+            return
+
+        endpoint.counter = counter
+        endpoint.beats += 1
+        endpoint.latency.observe(round_trip)
+        reconnect_scheduler.record_success(("watchdog", url))
+
+        # Keep the server's phase, skipping beats that were missed while it was slow
+        next_due = endpoint.next_due + self.interval
+        now = time.monotonic()
+        if next_due <= now:
+            next_due += (now - next_due) // self.interval * self.interval + self.interval
+        self._schedule(endpoint, next_due - now)
+
+
+    def metrics(self) -> dict:
+        """
+        Returns the counter, number of beats and failures and the round-trip latency histogram per server.
+        """
+        return {url: {
+                    "counter": endpoint.counter,
+                    "beats": endpoint.beats,
+                    "failures": endpoint.failures,
+                    "latency": endpoint.latency.snapshot(),
+                } for url, endpoint in self.endpoints.items()}
 
 
 async def main_watchdog(url: str, username: str, password: str):
     """
     Main function to initiate the Watchdog.
     """
-    watchdog = Watchdog(url, username, password)
+    watchdog = Watchdog()
+    watchdog.add_server(url, username, password)
     print("Starting watchdog")
     #await watchdog.configure_servers()
 
 
 if __name__ == "__main__":
     asyncio.run(main_watchdog("url", "username", "password"))
-
-
-
-
-
-
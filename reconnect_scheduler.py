@@ -0,0 +1,173 @@
+"""
+This file contains the ReconnectScheduler class, which is used to space out reconnect attempts to many endpoints
+with exponential backoff, full jitter and a per-endpoint circuit breaker.
+"""
+
+
+import asyncio
+import random
+import time
+from typing import Any, Dict, Hashable, Optional
+
+try:
+    from create_logger import setup_logger
+except ImportError:
+    print("The create_logger module was not found. Please make sure it is in the same directory as this script.")
+
+##############################
+FIRST_RETRY_DELAY = 2.0
+BASE_DELAY = 2.0
+MAX_DELAY = 60.0
+FAILURE_THRESHOLD = 5
+##############################
+
+# Circuit breaker states
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+logger = setup_logger(__name__)
+
+
+class EndpointState:
+    """
+    Reconnect and circuit breaker state of a single endpoint.
+    """
+
+    def __init__(self):
+        self.circuit = CIRCUIT_CLOSED
+        self.failures = 0
+        self.next_attempt = 0.0
+        self.outage_start: Optional[float] = None
+        self.reconnects = 0
+        self.last_time_to_reconnect: Optional[float] = None
+        self.max_time_to_reconnect = 0.0
+        self.total_time_to_reconnect = 0.0
+
+
+class ReconnectScheduler:
+    """
+    Schedules reconnect attempts for many endpoints.
+
+    The first retry after a failure comes quickly, after at most first_retry_delay seconds.
+    After that the delay grows exponentially from base_delay up to max_delay, with full
+    jitter so endpoints that failed at the same instant do not all reconnect at the same
+    instant. After failure_threshold failures in a row the circuit opens and the endpoint
+    is only probed every max_delay / 2 to max_delay seconds until a reconnect succeeds.
+
+    Usage
+    ----------
+    delay = reconnect_scheduler.record_failure(("alarm", url))
+    logger.warning(f"Reconnecting in {delay:.1f} seconds")
+    await reconnect_scheduler.wait(("alarm", url))
+    ...
+    reconnect_scheduler.record_success(("alarm", url))
+    """
+
+    def __init__(self, first_retry_delay: float = FIRST_RETRY_DELAY, base_delay: float = BASE_DELAY,
+                 max_delay: float = MAX_DELAY, failure_threshold: int = FAILURE_THRESHOLD):
+        self.first_retry_delay = first_retry_delay
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self._endpoints: Dict[Hashable, EndpointState] = {}
+
+
+    def _state(self, endpoint: Hashable) -> EndpointState:
+        state = self._endpoints.get(endpoint)
+        if state is None:
+            state = EndpointState()
+            self._endpoints[endpoint] = state
+        return state
+
+
+    def record_failure(self, endpoint: Hashable) -> float:
+        """
+        Record a failed connection or request and schedule the next attempt.
+
+        Parameters
+        ----------
+        endpoint - The endpoint that failed, keyed per consumer, e.g. ("alarm", url), so the
+                   failures of one user of a server do not hold back the others.
+
+        Returns
+        ----------
+        The delay in seconds until the next attempt.
+        """
+        state = self._state(endpoint)
+        now = time.monotonic()
+
+        if state.outage_start is None:
+            state.outage_start = now
+        state.failures += 1
+
+        if state.failures >= self.failure_threshold:
+            if state.circuit != CIRCUIT_OPEN:
+                logger.warning(f"Circuit opened for {endpoint} after {state.failures} failures")
+            state.circuit = CIRCUIT_OPEN
+            delay = random.uniform(self.max_delay / 2, self.max_delay)
+        elif state.failures == 1:
+            delay = random.uniform(0, self.first_retry_delay)
+        else:
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (state.failures - 1)))
+
+        state.next_attempt = now + delay
+        return delay
+
+
+    def record_success(self, endpoint: Hashable):
+        """
+        Record a successful connection, closing the circuit and updating the time-to-reconnect metrics.
+        """
+        state = self._state(endpoint)
+
+        if state.outage_start is not None:
+            time_to_reconnect = time.monotonic() - state.outage_start
+            state.reconnects += 1
+            state.last_time_to_reconnect = time_to_reconnect
+            state.total_time_to_reconnect += time_to_reconnect
+            state.max_time_to_reconnect = max(state.max_time_to_reconnect, time_to_reconnect)
+            logger.info(f"Reconnected to {endpoint} after {time_to_reconnect:.1f} seconds")
+
+        state.circuit = CIRCUIT_CLOSED
+        state.failures = 0
+        state.next_attempt = 0.0
+        state.outage_start = None
+
+
+    async def wait(self, endpoint: Hashable):
+        """
+        Sleep until the next attempt for the endpoint is due.
+        """
+        state = self._state(endpoint)
+        delay = state.next_attempt - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        if state.circuit == CIRCUIT_OPEN:
+            state.circuit = CIRCUIT_HALF_OPEN
+
+
+    def circuit(self, endpoint: Hashable) -> str:
+        return self._state(endpoint).circuit
+
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Returns the reconnect metrics of every endpoint.
+        """
+        metrics = {}
+        for endpoint, state in self._endpoints.items():
+            metrics[endpoint] = {
+                "circuit": state.circuit,
+                "failures": state.failures,
+                "reconnects": state.reconnects,
+                "last_time_to_reconnect": state.last_time_to_reconnect,
+                "max_time_to_reconnect": state.max_time_to_reconnect,
+                "mean_time_to_reconnect": (state.total_time_to_reconnect / state.reconnects
+                                           if state.reconnects else None),
+            }
+        return metrics
+
+
+reconnect_scheduler = ReconnectScheduler()
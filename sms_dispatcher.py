@@ -0,0 +1,279 @@
+"""
+This file contains the SmsDispatcher class, which is used to send SMS messages from a pool of worker threads
+with rate limiting, a bounded queue and retries, and the SmsCoalescer class, which batches alarms per recipient
+into digest messages.
+"""
+
+
+import asyncio
+import heapq
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+try:
+    from create_logger import setup_logger
+except ImportError:
+    print("The create_logger module was not found. Please make sure it is in the same directory as this script.")
+
+##############################
+SMS_WORKERS = 4
+SMS_RATE = 1.0
+SMS_BURST = 5
+SMS_QUEUE_SIZE = 1000
+SMS_MAX_RETRIES = 3
+SMS_RETRY_DELAY = 2.0
+SMS_COALESCE_WINDOW = 2.0
+SMS_DIGEST_SIZE = 3
+##############################
+
+logger = setup_logger(__name__)
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket that allows rate sends per second with bursts of up to capacity.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+
+    def acquire(self):
+        """
+        Blocks until a token is available and takes it.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class SmsDispatcher:
+    """
+    Sends SMS messages through one gateway from a pool of worker threads.
+
+    All workers share one token bucket, so the gateway never gets more than rate messages
+    per second (after an initial burst). Messages wait in a bounded queue, a failed send is
+    retried with exponential backoff, and metrics() reports the queue depth and outcomes.
+    Use one SmsDispatcher per gateway.
+
+    Parameters
+    ----------
+    send_func - The function that sends one message, called as send_func(phone_number, message).
+    workers - The number of worker threads.
+    rate - The maximum number of messages per second to the gateway.
+    burst - The number of messages that can be sent at once before the rate applies.
+    queue_size - The maximum number of waiting messages.
+    max_retries - The number of retries after a failed send.
+    retry_delay - The delay before the first retry in seconds, doubled for each retry.
+
+    Usage
+    ----------
+    sms_dispatcher = SmsDispatcher(send_sms)
+    sms_dispatcher.submit(phone_number, message)
+    """
+
+    def __init__(self, send_func: Callable[[str, str], Any], workers: int = SMS_WORKERS,
+                 rate: float = SMS_RATE, burst: int = SMS_BURST, queue_size: int = SMS_QUEUE_SIZE,
+                 max_retries: int = SMS_MAX_RETRIES, retry_delay: float = SMS_RETRY_DELAY):
+        self.send_func = send_func
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+
+        self._bucket = TokenBucket(rate, burst)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._metrics = {
+            "submitted": 0,
+            "rejected": 0,
+            "sent": 0,
+            "failed": 0,
+            "retries": 0,
+            "max_queue_depth": 0,
+            "total_latency": 0.0,
+        }
+
+        self._workers = [threading.Thread(target=self._worker, name=f"sms_worker_{index}", daemon=True)
+                         for index in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+
+    def submit(self, phone_number: str, message: str, block: bool = False) -> bool:
+        """
+        Queues a message for sending.
+
+        Parameters
+        ----------
+        phone_number - The phone number to send to.
+        message - The message to send.
+        block - If True, wait for room when the queue is full, else reject the message.
+
+        Returns
+        ----------
+        True if the message was queued, False if it was rejected because the queue is full.
+        """
+        try:
+            self._queue.put((phone_number, message, time.monotonic()), block=block)
+        except queue.Full:
+            with self._lock:
+                self._metrics["rejected"] += 1
+            logger.error(f"SMS queue is full, dropped message to {phone_number}")
+            return False
+
+        with self._lock:
+            self._metrics["submitted"] += 1
+            self._metrics["max_queue_depth"] = max(self._metrics["max_queue_depth"], self._queue.qsize())
+        return True
+
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                self._send(*item)
+            finally:
+                self._queue.task_done()
+
+
+    def _send(self, phone_number: str, message: str, queued_at: float):
+        for attempt in range(self.max_retries + 1):
+            self._bucket.acquire()
+            try:
+                self.send_func(phone_number, message)
+            except Exception as exception:
+                if attempt == self.max_retries:
+                    logger.error(f"Failed to send SMS to {phone_number} after {attempt + 1} attempts: {exception}")
+                    break
+                delay = self.retry_delay * 2 ** attempt
+                logger.warning(f"Failed to send SMS to {phone_number}: {exception} Retrying in {delay:.1f} seconds")
+                with self._lock:
+                    self._metrics["retries"] += 1
+                time.sleep(delay)
+            else:
+                with self._lock:
+                    self._metrics["sent"] += 1
+                    self._metrics["total_latency"] += time.monotonic() - queued_at
+                return
+
+        with self._lock:
+            self._metrics["failed"] += 1
+
+
+    def join(self):
+        """
+        Blocks until every queued message has been sent or has failed.
+        """
+        self._queue.join()
+
+
+    def stop(self):
+        """
+        Sends the queued messages and stops the workers.
+        """
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        Returns the dispatcher metrics: the queue depth, counts of submitted, rejected, sent,
+        failed and retried messages, and the mean time from submit to sent.
+        """
+        with self._lock:
+            metrics = dict(self._metrics)
+        total_latency = metrics.pop("total_latency")
+        metrics["queue_depth"] = self._queue.qsize()
+        metrics["mean_latency"] = total_latency / metrics["sent"] if metrics["sent"] else None
+        return metrics
+
+
+class SmsCoalescer:
+    """
+    Holds the alarms for each recipient for a short window and then sends one digest SMS.
+
+    The first alarm for a recipient starts a window of window seconds on the running event
+    loop. Every alarm for that recipient within the window is collected, and when it ends one
+    message with the top_n alarms by severity and the number of remaining alarms is submitted.
+    With a window of 0 every alarm is submitted right away.
+
+    Parameters
+    ----------
+    submit - Called as submit(phone_number, message) to send a digest, e.g. SmsDispatcher.submit.
+    format_digest - Called as format_digest(alarms, remaining) with the top alarms as a list of
+    (message, severity), highest severity first, and the number of alarms left out. Returns the SMS text.
+    window - The number of seconds to collect alarms per recipient.
+    top_n - The maximum number of alarms in a digest.
+
+    Usage
+    ----------
+    sms_coalescer = SmsCoalescer(sms_dispatcher.submit, format_digest)
+    sms_coalescer.add(phone_number, alarm_message, severity)
+    """
+
+    def __init__(self, submit: Callable[[str, str], Any],
+                 format_digest: Callable[[List[Tuple[str, int]], int], str],
+                 window: float = SMS_COALESCE_WINDOW, top_n: int = SMS_DIGEST_SIZE):
+        self.submit = submit
+        self.format_digest = format_digest
+        self.window = window
+        self.top_n = top_n
+        self.alarms_received = 0
+        self.digests_sent = 0
+        self._pending: Dict[str, List[Tuple[int, int, str]]] = {}
+
+
+    def add(self, phone_number: str, alarm_message: str, severity: int):
+        """
+        Adds an alarm for a recipient. Must be called from the event loop.
+        """
+        self.alarms_received += 1
+        if self.window <= 0:
+            self._send(phone_number, [(alarm_message, severity)], 0)
+            return
+
+        pending = self._pending.get(phone_number)
+        if pending is None:
+            pending = []
+            self._pending[phone_number] = pending
+            asyncio.get_running_loop().call_later(self.window, self.flush, phone_number)
+        pending.append((severity, len(pending), alarm_message))
+
+
+    def flush(self, phone_number: str):
+        """
+        Sends the digest for a recipient now.
+        """
+        pending = self._pending.pop(phone_number, None)
+        if not pending:
+            return
+
+        top = heapq.nsmallest(self.top_n, pending, key=lambda alarm: (-alarm[0], alarm[1]))
+        alarms = [(alarm_message, severity) for severity, _, alarm_message in top]
+        self._send(phone_number, alarms, len(pending) - len(alarms))
+
+
+    def flush_all(self):
+        for phone_number in list(self._pending):
+            self.flush(phone_number)
+
+
+    def _send(self, phone_number: str, alarms: List[Tuple[str, int]], remaining: int):
+        self.digests_sent += 1
+        self.submit(phone_number, self.format_digest(alarms, remaining))
@@ -0,0 +1,141 @@
+"""
+This file contains the TimerWheel class, which is used to run many timers, like keep-alive deadlines
+and heartbeats, from one asyncio task instead of one sleeping task per timer.
+"""
+
+
+import asyncio
+import inspect
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional, Set
+
+try:
+    from create_logger import setup_logger
+except ImportError:
+    print("The create_logger module was not found. Please make sure it is in the same directory as this script.")
+
+##############################
+TIMER_WHEEL_TICK = 1.0
+TIMER_WHEEL_SLOTS = 512
+##############################
+
+logger = setup_logger(__name__)
+
+
+class _Timer:
+    __slots__ = ("deadline", "delay", "callback")
+
+    def __init__(self, deadline: float, delay: float, callback: Callable[[], Any]):
+        self.deadline = deadline
+        self.delay = delay
+        self.callback = callback
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel that runs every timer from one asyncio task.
+
+    Each timer sits in the slot of the tick it is due in. Every tick the task only looks at the
+    timers in one slot, so the cost does not grow with the number of timers, and timers that
+    are not due cost nothing. Resetting a timer only moves its deadline, the timer is moved to
+    its new slot the next time its old slot comes up. The task stops while there are no timers.
+
+    Parameters
+    ----------
+    tick - The resolution of the timers in seconds.
+    slots - The number of slots in the wheel.
+
+    Usage
+    ----------
+    timer_wheel = TimerWheel()
+    timer_wheel.schedule(key, 30, on_missed_deadline)
+    timer_wheel.reset(key)  # Push the deadline another 30 seconds out
+    """
+
+    def __init__(self, tick: float = TIMER_WHEEL_TICK, slots: int = TIMER_WHEEL_SLOTS):
+        self.tick = tick
+        self._slots: List[Set[Hashable]] = [set() for _ in range(slots)]
+        self._timers: Dict[Hashable, _Timer] = {}
+        self._start = time.monotonic()
+        self._current_tick = 0
+        self._task: Optional[asyncio.Task] = None
+
+
+    def _tick_of(self, deadline: float) -> int:
+        return max(int((deadline - self._start) / self.tick) + 1, self._current_tick + 1)
+
+
+    def _place(self, key: Hashable, timer: _Timer):
+        self._slots[self._tick_of(timer.deadline) % len(self._slots)].add(key)
+
+
+    def schedule(self, key: Hashable, delay: float, callback: Callable[[], Any]):
+        """
+        Calls callback after delay seconds, replacing any timer with the same key.
+        The callback may be a coroutine function. Must be called from the event loop.
+        """
+        timer = _Timer(time.monotonic() + delay, delay, callback)
+        self._timers[key] = timer
+        self._place(key, timer)
+
+        if self._task is None or self._task.done():
+            self._start = time.monotonic()
+            self._current_tick = 0
+            for slot in self._slots:
+                slot.clear()
+            for timer_key, wheel_timer in self._timers.items():
+                self._place(timer_key, wheel_timer)
+            self._task = asyncio.create_task(self._run())
+
+
+    def reset(self, key: Hashable, delay: Optional[float] = None):
+        """
+        Moves the deadline of a timer to delay seconds from now, by default its original delay.
+        """
+        timer = self._timers.get(key)
+        if timer is not None:
+            timer.deadline = time.monotonic() + (timer.delay if delay is None else delay)
+
+
+    def cancel(self, key: Hashable):
+        self._timers.pop(key, None)
+
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._timers
+
+
+    def __len__(self) -> int:
+        return len(self._timers)
+
+
+    async def _run(self):
+        while self._timers:
+            next_tick = self._start + (self._current_tick + 1) * self.tick
+            await asyncio.sleep(max(0.0, next_tick - time.monotonic()))
+
+            now = time.monotonic()
+            due_tick = int((now - self._start) / self.tick)
+            while self._current_tick < due_tick:
+                self._current_tick += 1
+                self._expire(self._slots[self._current_tick % len(self._slots)], now)
+
+
+    def _expire(self, slot: Set[Hashable], now: float):
+        for key in list(slot):
+            slot.discard(key)
+            timer = self._timers.get(key)
+            if timer is None:
+                continue
+
+            if timer.deadline > now:
+                self._place(key, timer)
+                continue
+
+            del self._timers[key]
+            try:
+                result = timer.callback()
+                if inspect.isawaitable(result):
+                    asyncio.ensure_future(result)
+            except Exception as exception:
+                logger.error(f"Error in timer callback for {key}: {exception}")